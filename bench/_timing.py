@@ -0,0 +1,28 @@
+"""Timing helpers shared by the benchmarks.
+
+Uses `time.ticks_us` on MicroPython and falls back to `time.perf_counter` on CPython.
+The benchmark scripts import this module from their own directory, which is on
+`sys.path` when they're run as `python bench/<name>.py`.
+"""
+
+import time
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    ticks_us = lambda: int(time.perf_counter() * 1_000_000)  # noqa: E731
+    ticks_diff = lambda a, b: a - b  # noqa: E731
+
+
+def measure(func, args=(), rounds=1000) -> float:
+    """Returns the average time of `func(*args)` in microseconds."""
+    started_at = ticks_us()
+    for _ in range(rounds):
+        func(*args)
+    return max(1, ticks_diff(ticks_us(), started_at)) / rounds
+
+
+def throughput(func, payload, rounds, *args) -> float:
+    """Returns how fast `func(payload, *args)` gets through `payload` in MB/s."""
+    return len(payload) / measure(func, (payload,) + args, rounds)  # bytes/us == MB/s
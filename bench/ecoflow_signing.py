@@ -0,0 +1,71 @@
+"""Benchmarks Ecoflow query canonicalization with and without the per-shape cache.
+
+Runs under CPython and the MicroPython unix port:
+
+    python bench/ecoflow_signing.py
+    micropython bench/ecoflow_signing.py
+"""
+
+import sys
+
+sys.path.insert(0, "code")
+sys.path.insert(0, "lib_sources")
+
+
+# ecoflow.py imports board-only modules and credentials at import time,
+# inert stand-ins are enough to construct the API objects
+class _Stub:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return _Stub()
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+
+class _Credentials:
+    ecoflow_access_key = ecoflow_secret_key = ecoflow_sn = "0"
+    tg_bot_token = tg_admin_chat_id = "0"
+
+
+for _name in ("machine", "urequests"):
+    try:
+        __import__(_name)
+    except ImportError:
+        sys.modules[_name] = _Stub()
+try:
+    import credentials  # noqa: F401
+except ImportError:
+    sys.modules["credentials"] = _Stub()
+    sys.modules["credentials"].Credentials = _Credentials
+
+from _timing import measure  # noqa: E402
+from ecoflow import EcoflowDeviceApi  # noqa: E402
+
+ROUNDS = 2000
+QUOTAS = ["bms_bmsStatus.chgState", "pd.remainTime", "pd.soc"]
+
+
+def main():
+    api = EcoflowDeviceApi("Fp4SvIprYSDPXtYJidEtUAd1o", "secret", "R331ZEB4ZEAB0000")
+    body = {"sn": "R331ZEB4ZEAB0000", "params": {"quotas": QUOTAS}}
+    cache_key = tuple(QUOTAS)
+
+    def uncached(nonce, timestamp):
+        return api._stringify_query(nonce, timestamp, body)
+
+    def cached(nonce, timestamp):
+        return api._stringify_query(nonce, timestamp, body, cache_key=cache_key)
+
+    assert uncached(1, 2) == cached(1, 2)
+    print(cached(1, 2))
+
+    baseline = measure(uncached, (100000, 1671171709428), ROUNDS)
+    optimized = measure(cached, (100000, 1671171709428), ROUNDS)
+    print("uncached: {:.2f} us/op".format(baseline))
+    print("cached:   {:.2f} us/op ({:.1f}x)".format(optimized, baseline / optimized))
+
+
+main()
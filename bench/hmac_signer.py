@@ -0,0 +1,51 @@
+"""Benchmarks request signing: vendored `hmac.new` per request vs `HmacSha256Signer`.
+
+Runs under CPython and the MicroPython unix port:
+
+    python bench/hmac_signer.py
+    micropython bench/hmac_signer.py
+"""
+
+import sys
+
+# The vendored hmac must shadow CPython's stdlib module
+sys.path.insert(0, "code")
+sys.path.insert(0, "lib_sources")
+
+import hmac
+
+from _timing import measure
+from signer import HmacSha256Signer
+
+KEY = b"0123456789abcdef0123456789abcdef"
+MESSAGES = (
+    # Ecoflow quota query string
+    b"params.quotas[0]=bms_bmsStatus.chgState&params.quotas[1]=pd.remainTime"
+    b"&params.quotas[2]=pd.soc&sn=R331ZEB4ZEAB0000&accessKey=Fp4SvIprYSDPXtYJidEtUAd1o"
+    b"&nonce=345164&timestamp=1671171709428",
+    # Tuya string to sign
+    b"x1y2z3" * 20,
+)
+ROUNDS = 2000
+
+
+def sign_hmac_new(msg):
+    return hmac.new(KEY, msg, "sha256").hexdigest()
+
+
+def main():
+    signer = HmacSha256Signer(KEY)
+
+    print("message bytes   hmac.new us/op   signer us/op   speedup")
+    for msg in MESSAGES:
+        assert signer.hexdigest(msg) == sign_hmac_new(msg)
+        baseline = measure(sign_hmac_new, (msg,), ROUNDS)
+        optimized = measure(signer.hexdigest, (msg,), ROUNDS)
+        print(
+            "{:>13}   {:>14.2f}   {:>12.2f}   {:>6.1f}x".format(
+                len(msg), baseline, optimized, baseline / optimized
+            )
+        )
+
+
+main()
@@ -0,0 +1,73 @@
+"""Benchmarks permessage-deflate against uncompressed WebSocket frames.
+
+Reports the wire size and the encode / decode throughput of a typical JSON
+push payload for both variants. The board uses MicroPython's `deflate` module,
+which only the MicroPython unix port measures; CPython falls back to `zlib`:
+
+    python bench/ws_deflate.py
+    micropython bench/ws_deflate.py
+"""
+
+import json
+import sys
+
+sys.path.insert(0, "lib_sources")
+
+from _timing import throughput
+from aiohttp.aiohttp_ws import WebSocketClient, _PerMessageDeflate
+
+SIZES = (1024, 4096, 16384, 65536)
+WBITS = 10
+
+
+def _make_payload(size):
+    # Looks like a quota push: repetitive keys, varying numbers
+    quota = {}
+    i = 0
+    while len(json.dumps(quota)) < size:
+        quota["bms_bmsStatus.cellVol{}".format(i)] = 3300 + i % 97
+        i += 1
+    return json.dumps(quota).encode()[:size]
+
+
+def main():
+    codec = _PerMessageDeflate(WBITS, WBITS)
+
+    def encode_plain(payload):
+        return WebSocketClient._encode_websocket_frame(WebSocketClient.TEXT, payload)
+
+    def encode_deflate(payload):
+        return WebSocketClient._encode_websocket_frame(
+            WebSocketClient.TEXT, codec.compress(payload), compressed=True
+        )
+
+    if codec._deflate is None:
+        # Only MicroPython's deflate runs on the board, these numbers are a proxy
+        print("codec: zlib, CPython fallback; run under MicroPython for `deflate`")
+    else:
+        print("codec: deflate, as on the board")
+    print("window bits: {}".format(WBITS))
+    print(
+        "size      wire bytes   ratio   plain enc MB/s   deflate enc MB/s   inflate MB/s"
+    )
+    for size in SIZES:
+        payload = _make_payload(size)
+        compressed = codec.compress(payload)
+        assert codec.decompress(compressed, size) == payload
+
+        rounds = max(1, 65536 // size)
+        print(
+            "{:>5} KB  {:>10}   {:>5.2f}   {:>14.2f}   {:>16.2f}   {:>12.2f}".format(
+                size // 1024,
+                len(compressed),
+                len(payload) / len(compressed),
+                throughput(encode_plain, payload, rounds * 4),
+                throughput(encode_deflate, payload, rounds),
+                len(payload)
+                / len(compressed)
+                * throughput(codec.decompress, compressed, rounds, size),
+            )
+        )
+
+
+main()
@@ -0,0 +1,95 @@
+"""Shared setup of the checks in this directory, CPython only.
+
+Importing it puts `code/` and the vendored libraries on `sys.path` and installs the
+stand-ins from `host/run.py`, so checks can import the application modules directly.
+`start_simulator()` serves `simulator.py` from the same event loop, with the check
+`Credentials` below pointing `code/` at it.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# simulator.py needs CPython's hmac, import it before the vendored one shadows it
+sys.path.insert(0, ROOT)
+import simulator  # noqa: E402
+
+sys.path.insert(0, f"{ROOT}/host")
+import run  # noqa: E402
+
+run.install_shims()
+run.install_cpython_compat()
+run.use_host_clock()
+
+HTTP_PORT = 18080
+MQTT_PORT = 18883
+TUYA_LAN_PORT = 18668
+
+
+class Credentials:
+    ecoflow_access_key = "check-ecoflow-access-key"
+    ecoflow_secret_key = "check-ecoflow-secret-key"
+    tuya_access_id = "check-tuya-access-id"
+    tuya_access_key = "check-tuya-access-key"
+    tg_bot_token = "0:check"
+    tg_admin_chat_id = tg_info_chat_id = "1"
+    simulator_url = f"http://127.0.0.1:{HTTP_PORT}"
+    devices = [
+        {
+            "name": "Plug 3.3",
+            "ecoflow_sn": "R331CHECK0000033",
+            "tuya_device_id": "check0000000033",
+            "tuya_local_key": "0123456789abcdef",
+            "tuya_ip": "127.0.0.1",
+            "tuya_version": "3.3",
+        },
+        {
+            "name": "Plug 3.4",
+            "ecoflow_sn": "R331CHECK0000034",
+            "tuya_device_id": "check0000000034",
+            "tuya_local_key": "fedcba9876543210",
+            "tuya_ip": "127.0.0.1",
+            "tuya_version": "3.4",
+        },
+    ]
+
+
+sys.modules["credentials"] = types.ModuleType("credentials")
+sys.modules["credentials"].Credentials = Credentials
+
+from clock import Clock  # noqa: E402
+
+Clock.setup()  # From the host clock, see run.use_host_clock()
+
+
+def quiet_logs():
+    """Keeps log lines on the console, away from the simulated Telegram and the repo."""
+    import logger
+    from logstore import LogStore
+
+    LogStore.directory = tempfile.mkdtemp(prefix="check-logs-")
+    logger.LogSink.running = True  # Queued but never sent
+
+
+async def start_simulator(faults=None):
+    """Serves the simulator's HTTP, MQTT and Tuya LAN endpoints on the check ports."""
+    from tuya_local import TuyaLocalDevice
+
+    TuyaLocalDevice.port = TUYA_LAN_PORT
+    sim = simulator.Simulator(
+        Credentials, faults or simulator.Faults(), "127.0.0.1", MQTT_PORT, 1.0, 40.0
+    )
+    sim.servers = [
+        await asyncio.start_server(sim.handle_http, "127.0.0.1", HTTP_PORT),
+        await asyncio.start_server(sim.handle_mqtt, "127.0.0.1", MQTT_PORT),
+        await asyncio.start_server(sim.handle_tuya_lan, "127.0.0.1", TUYA_LAN_PORT),
+    ]
+    return sim
+
+
+def passed(name: str):
+    print(f"ok    {name}")
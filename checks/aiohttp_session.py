@@ -0,0 +1,80 @@
+"""Checks that concurrent requests on one `aiohttp.ClientSession` keep their own sockets.
+
+The Ecoflow and Tuya clients share a class-level session, and up to
+`concurrency.tls_limiter` requests run on it at once. Each request must read from and
+close its own connection, whichever request finishes first.
+
+    python checks/aiohttp_session.py
+"""
+
+import asyncio
+
+import _harness
+
+import aiohttp
+
+PORT = 18090
+
+
+class Server:
+    """Answers `/<delay_ms>` after the delay and counts connections the client closed."""
+
+    def __init__(self):
+        self.open = 0
+        self.closed_by_client = 0
+
+    async def handle(self, reader, writer):
+        self.open += 1
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            delay_ms = int(request_line.split()[1][1:])
+
+            body = b'{"delay_ms": %d}' % delay_ms
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body))
+            await writer.drain()
+            # Headers first, the body later, so the client is mid-read meanwhile
+            await asyncio.sleep(delay_ms / 1000)
+            writer.write(body)
+            await writer.drain()
+
+            # Connection: close is the client's to act on here
+            if await reader.read() == b"":
+                self.closed_by_client += 1
+        finally:
+            self.open -= 1
+            writer.close()
+
+
+async def main():
+    server = Server()
+    await asyncio.start_server(server.handle, "127.0.0.1", PORT)
+    session = aiohttp.ClientSession(f"http://127.0.0.1:{PORT}")
+
+    async def get(delay_ms: int, hold_s: float = 0) -> dict:
+        async with session.get(f"/{delay_ms}") as response:
+            data = await response.json()
+            await asyncio.sleep(hold_s)  # Stay inside the block a little longer
+            return data
+
+    # The first request leaves while the second one still waits for its body
+    first = asyncio.create_task(get(0, hold_s=0.1))
+    await asyncio.sleep(0.05)
+    second = asyncio.create_task(get(300))
+    assert await first == {"delay_ms": 0}
+    assert await second == {"delay_ms": 300}
+    _harness.passed("a request leaving first doesn't close the other's socket")
+
+    # And the other way round, the second request leaves first
+    results = await asyncio.gather(get(200), get(0))
+    assert results == [{"delay_ms": 200}, {"delay_ms": 0}]
+    _harness.passed("a request leaving last doesn't close the other's socket")
+
+    await asyncio.sleep(0.1)
+    assert server.open == 0, f"{server.open} connections left open"
+    assert server.closed_by_client == 4, server.closed_by_client
+    _harness.passed("every request closed its own connection")
+
+
+asyncio.run(main())
@@ -0,0 +1,56 @@
+"""Checks that bot commands running at the same time all complete.
+
+Status and Relay OFF run as tasks next to the long poll, all of them on the shared
+Telegram, Ecoflow and Tuya sessions, with some cloud latency so they overlap.
+
+    python checks/bot_commands.py
+"""
+
+import asyncio
+import os
+import tempfile
+
+import _harness
+
+_harness.quiet_logs()
+
+import logger  # noqa: E402
+from bot import BotState, TelegramBot  # noqa: E402
+from simulator import Faults  # noqa: E402
+
+
+def logged(text: str) -> list:
+    return [line for _, line in logger.LogSink._queue if text in line]
+
+
+async def main():
+    sim = await _harness.start_simulator(Faults(latency_ms=200))
+    BotState.path = os.path.join(tempfile.mkdtemp(prefix="check-bot-"), "state.json")
+    TelegramBot.long_polling_timeout_s = 2
+
+    listener = asyncio.create_task(TelegramBot.listen())
+    await asyncio.sleep(0.5)  # Long poll in flight
+    for text in ("Status", "Relay OFF", "Logs"):
+        sim.inject_message(text)
+        await asyncio.sleep(0.05)
+
+    for _ in range(100):
+        if len(logged("command done")) == 3:
+            break
+        await asyncio.sleep(0.1)
+    assert len(logged("command done")) == 3, logged("command")
+    assert not logged("An error occurred"), logged("An error occurred")
+    _harness.passed("Status, Relay OFF and Logs ran side by side")
+
+    assert len(logged("Relay is off")) == len(sim.relays)
+    assert not any(relay.relay_on for relay in sim.relays.values())
+    assert all(len(logged(f"{pair} status:")) == 1 for pair in ("Plug 3.3", "Plug 3.4"))
+    _harness.passed("each command reported its own results")
+
+    sim.inject_message("Stop bot")
+    await asyncio.wait_for(listener, TelegramBot.long_polling_timeout_s + 5)
+    assert BotState.offset == 5, BotState.offset
+    _harness.passed("polling went on while the commands ran")
+
+
+asyncio.run(main())
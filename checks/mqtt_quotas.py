@@ -0,0 +1,164 @@
+"""Checks `MqttClient` against a scripted broker and `EcoflowQuotaSubscriber` against
+the simulator's broker.
+
+The scripted broker checks the bytes of CONNECT, SUBSCRIBE and PUBACK, and goes silent
+to let the keepalive timeout fire. The subscriber seeds its values over HTTP, takes
+pushed updates, and waits for a device that is offline while it connects.
+
+    python checks/mqtt_quotas.py
+"""
+
+import asyncio
+import struct
+import time
+
+import _harness
+
+_harness.quiet_logs()
+
+from devices import registry  # noqa: E402
+from ecoflow import Delta2Params  # noqa: E402
+from mqtt import MqttClient  # noqa: E402
+
+BROKER_PORT = 18884
+TOPIC = "/open/account/R331CHECK0000033/quota"
+
+
+class ScriptedBroker:
+    """Serves one connection, answering only the first `pings_answered` PINGREQs."""
+
+    def __init__(self, pings_answered: int):
+        self.pings_answered = pings_answered
+        self.packets = []  # (header, body) received from the client
+        self.puback = asyncio.Event()
+        self.silent_since = None
+
+    async def read_packet(self, reader):
+        header = (await reader.readexactly(1))[0]
+        length, shift = 0, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        packet = header, await reader.readexactly(length)
+        self.packets.append(packet)
+        return packet
+
+    async def handle(self, reader, writer):
+        header, body = await self.read_packet(reader)
+        assert header == MqttClient.CONNECT, hex(header)
+        assert body == (
+            b"\x00\x04MQTT\x04\xc2\x00\x01" b"\x00\x05check\x00\x04user\x00\x08password"
+        ), body
+        writer.write(b"\x20\x02\x00\x00")
+
+        header, body = await self.read_packet(reader)
+        assert header == MqttClient.SUBSCRIBE, hex(header)
+        packet_id = body[:2]
+        assert body[2:] == struct.pack("!H", len(TOPIC)) + TOPIC.encode() + b"\x01"
+        writer.write(b"\x90\x03" + packet_id + b"\x01")
+
+        # QoS 1, packet ID 0x1234
+        message = struct.pack("!H", len(TOPIC)) + TOPIC.encode() + b"\x12\x34{}"
+        writer.write(bytes((0x32, len(message))) + message)
+        await writer.drain()
+
+        header, body = await self.read_packet(reader)
+        assert (header, body) == (MqttClient.PUBACK, b"\x12\x34"), (header, body)
+        self.puback.set()
+
+        try:
+            while True:
+                header, body = await self.read_packet(reader)
+                if header == MqttClient.DISCONNECT:
+                    break
+                assert header == MqttClient.PINGREQ, hex(header)
+                if self.pings_answered:
+                    self.pings_answered -= 1
+                    writer.write(b"\xd0\x00")
+                    await writer.drain()
+                elif self.silent_since is None:
+                    self.silent_since = time.monotonic()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+
+async def check_client():
+    broker = ScriptedBroker(pings_answered=1)
+    server = await asyncio.start_server(broker.handle, "127.0.0.1", BROKER_PORT)
+
+    client = MqttClient("check", "user", "password", keepalive_s=1)
+    await client.connect("127.0.0.1", BROKER_PORT, ssl=False)
+    await client.subscribe(TOPIC)
+    assert await client.receive() == (TOPIC, b"{}")
+    await asyncio.wait_for(broker.puback.wait(), 1)
+    _harness.passed("CONNECT, SUBSCRIBE and a QoS 1 PUBLISH answered with PUBACK")
+
+    started_at = time.monotonic()
+    try:
+        await client.receive()
+        raise AssertionError("receive() returned on a silent connection")
+    except asyncio.TimeoutError:
+        pass
+    elapsed_s = time.monotonic() - started_at
+    assert broker.silent_since is not None, "the unanswered ping never arrived"
+    # The answered ping comes after 0.5s, then nothing for 1.5 keepalive periods
+    assert 1.9 < elapsed_s < 2.5, f"timed out after {elapsed_s:.2f}s"
+    await client.close()
+    server.close()
+    _harness.passed(f"silent broker detected after {elapsed_s:.2f}s")
+
+
+async def wait_for(condition, timeout_s: float, what: str):
+    for _ in range(int(timeout_s * 20)):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"timed out waiting until {what}")
+
+
+async def check_subscriber():
+    sim = await _harness.start_simulator()
+    sim.push_interval_s = 0.2
+    subscriber = registry.quota_subscriber
+    subscriber.reconnect_delay_s = 0.5
+    online, offline = [pair.delta2._api for pair in registry.pairs]
+    sim.devices[offline._sn].online = False
+
+    task = asyncio.create_task(subscriber.run())
+    await wait_for(lambda: subscriber._connected, 5, "subscribed")
+    assert online._push_connected and not offline._push_connected
+    seeded = online._cached_quotas(list(Delta2Params.TELEMETRY))
+    assert seeded == sim.devices[online._sn].quotas(), seeded
+    assert offline._cached_quotas([Delta2Params.SOC]) is None
+    _harness.passed("_seed stored the online device's values, skipped the offline one")
+
+    sim.devices[online._sn].ac_enabled = False
+    await wait_for(
+        lambda: online._quotas[Delta2Params.AC_ENABLED] == 0, 2, "the push was stored"
+    )
+    assert set(online._quotas) == set(Delta2Params.TELEMETRY), online._quotas
+    _harness.passed("_store took a pushed update")
+
+    sim.devices[offline._sn].online = True
+    await wait_for(lambda: offline._push_connected, 5, "the device was seeded")
+    assert (
+        offline._quotas[Delta2Params.SOC]
+        == sim.devices[offline._sn].quotas()[Delta2Params.SOC]
+    )
+    assert subscriber._connected and not subscriber._unseeded
+    _harness.passed("a device back online was seeded on the same connection")
+
+    task.cancel()
+
+
+async def main():
+    await check_client()
+    await check_subscriber()
+
+
+asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Checks `TuyaLocalDevice` round trips against the simulator's plug emulator.
+
+Each plug is switched and read back over protocol 3.3 and 3.4, the latter with a
+negotiated session key. Then the emulator drops every connection, and the next command
+has to reconnect once on its own.
+
+    python checks/tuya_lan.py
+"""
+
+import asyncio
+
+import _harness
+
+_harness.quiet_logs()
+
+from devices import registry  # noqa: E402
+
+
+async def round_trip(local, relay, switch_on: bool):
+    await local.set_dps({"1": switch_on})
+    assert relay.relay_on is switch_on
+    assert await local.get_dps() == {"1": switch_on}
+
+
+async def main():
+    sim = await _harness.start_simulator()
+    lan_server = sim.servers[2]
+    plugs = [
+        (pair.switch._local, sim.relays[pair.switch.device_id])
+        for pair in registry.pairs
+    ]
+
+    for local, relay in plugs:
+        for switch_on in (False, True, False):
+            await round_trip(local, relay, switch_on)
+        version = "3.4" if local._v34 else "3.3"
+        _harness.passed(f"set_dps and get_dps over protocol {version}")
+
+    local_34 = plugs[1][0]
+    assert local_34._v34 and len(local_34._key) == 16
+    assert local_34._key != local_34._local_key
+    _harness.passed("protocol 3.4 switched to a negotiated session key")
+
+    # Stale connections, like after the plugs rebooted
+    writers = [local._writer for local, _ in plugs]
+    session_key = local_34._key
+    lan_server.close_clients()
+    await asyncio.sleep(0.1)
+
+    for (local, relay), writer in zip(plugs, writers):
+        await round_trip(local, relay, True)
+        assert local._writer is not None and local._writer is not writer
+    assert local_34._key not in (session_key, local_34._local_key)
+    _harness.passed("reconnected once after the plugs dropped the connections")
+
+    for local, _ in plugs:
+        await local.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Checks switching several relays at once, over the LAN and with cloud fallbacks.
+
+Fallbacks to the cloud run concurrently on the shared `TuyaApi._session`, see
+`checks/aiohttp_session.py` for the session itself.
+
+    python checks/tuya_relays.py
+"""
+
+import asyncio
+import time
+
+import _harness
+
+_harness.quiet_logs()
+
+import tuya  # noqa: E402
+from devices import registry  # noqa: E402
+from simulator import Faults  # noqa: E402
+from tuya import TuyaSwitch  # noqa: E402
+from tuya_local import TuyaLocalDevice  # noqa: E402
+
+
+async def main():
+    sim = await _harness.start_simulator(Faults(latency_ms=300))
+    switches = [pair.switch for pair in registry.pairs]
+    relays = [sim.relays[switch.device_id] for switch in switches]
+
+    # Over the LAN, the cloud latency doesn't apply
+    results = await TuyaSwitch.set_switches(switches, False)
+    assert all(
+        r == {"success": True, "result": True} for r in results.values()
+    ), results
+    assert not any(relay.relay_on for relay in relays)
+    _harness.passed("relays switched over the LAN")
+
+    # Plugs that reject the local key, so every command falls back to the cloud
+    fallbacks = [
+        TuyaSwitch(
+            tuya.api,
+            switch.device_id,
+            TuyaLocalDevice(switch.device_id, "0000000000000000", "127.0.0.1", "3.3"),
+        )
+        for switch in switches
+    ]
+    await TuyaSwitch.get_switches(fallbacks)  # Fetches the token beforehand
+    started_at = time.monotonic()
+    results = await TuyaSwitch.set_switches(fallbacks, True)
+    elapsed_s = time.monotonic() - started_at
+    assert all(r["success"] for r in results.values()), results
+    assert all(relay.relay_on for relay in relays)
+    assert elapsed_s < 0.55, f"cloud fallbacks didn't overlap: {elapsed_s:.2f}s"
+    _harness.passed(f"concurrent cloud fallbacks in {elapsed_s:.2f}s")
+
+    assert await TuyaSwitch.get_switches(fallbacks) == {
+        switch.device_id: True for switch in switches
+    }
+    _harness.passed("relay states read back in one call")
+
+
+asyncio.run(main())
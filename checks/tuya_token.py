@@ -0,0 +1,47 @@
+"""Checks that concurrent requests and the background refresh share one new Tuya token.
+
+    python checks/tuya_token.py
+"""
+
+import asyncio
+
+import _harness
+
+_harness.quiet_logs()
+
+import tuya  # noqa: E402
+from simulator import Faults  # noqa: E402
+
+
+async def main():
+    sim = await _harness.start_simulator(Faults(latency_ms=100))
+    api = tuya.api
+    device_ids = [config["tuya_device_id"] for config in _harness.Credentials.devices]
+
+    async def read_statuses():
+        return set(await api.get_statuses(device_ids))
+
+    assert await read_statuses() == set(device_ids)
+    assert len(sim.tuya_tokens) == 1
+    _harness.passed("first request fetched a token")
+
+    # Revoked on the server, both requests get "token invalid" at the same time
+    sim.tuya_tokens.clear()
+    results = await asyncio.gather(read_statuses(), read_statuses())
+    assert results == [set(device_ids)] * 2, results
+    assert len(sim.tuya_tokens) == 1, f"{len(sim.tuya_tokens)} tokens fetched"
+    assert api._access_token in sim.tuya_tokens
+    _harness.passed("concurrent retries fetched one new token")
+
+    # The background refresh runs while a request retries with a revoked token
+    sim.tuya_tokens.clear()
+    refresh_tokens = set(sim.tuya_refresh_tokens)
+    refresh = asyncio.create_task(api._refresh_later(0))
+    assert await read_statuses() == set(device_ids)
+    await refresh
+    assert len(sim.tuya_tokens) == 1, f"{len(sim.tuya_tokens)} tokens fetched"
+    assert len(refresh_tokens - sim.tuya_refresh_tokens) == 1
+    _harness.passed("refresh and retry spent the refresh token once")
+
+
+asyncio.run(main())
@@ -18,12 +18,14 @@ import aiohttp
 import asyncio
 import gc
 
-from logger import log_error
+from logger import LogSink, log_error
+from logstore import LogStore
 from periphery import RedLed
 from wifi import WiFi
 from clock import Clock
-from bot import TelegramBot
+from bot import BotState, TelegramBot
 from logic import Logic
+from devices import registry
 
 
 async def app():
@@ -36,6 +38,13 @@ async def app():
     # Setup clock and synchronize RTC via NTP
     WiFi.ensure_wifi_sync(Clock.setup)
 
+    # Ship log lines to Telegram and flash in the background from now on
+    asyncio.create_task(catch_error(LogSink.run()))
+    asyncio.create_task(catch_error(LogStore.run()))
+
+    # Continue from the update offset and info message saved before the reboot
+    BotState.load()
+
     # Start Telegram bot admin listener
     bot_admin_task = asyncio.create_task(
         catch_error(WiFi.ensure_wifi(TelegramBot.listen))
@@ -46,13 +55,23 @@ async def app():
         catch_error(WiFi.ensure_wifi(TelegramBot.send_info))
     )
 
-    # Start cutoff logic
-    cutoff_task = asyncio.create_task(catch_error(WiFi.ensure_wifi(Logic.run)))
+    # Start receiving pushed Delta2 telemetry, HTTP polling is used while it's down
+    mqtt_task = asyncio.create_task(
+        catch_error(WiFi.ensure_wifi(registry.quota_subscriber.run))
+    )
+
+    # Start cutoff logic, one state machine per (Delta2, relay) pair
+    cutoff_tasks = [
+        asyncio.create_task(catch_error(WiFi.ensure_wifi(Logic(pair).run)))
+        for pair in registry.pairs
+    ]
 
     # Await tasks
     await bot_admin_task
     await bot_info_task
-    await cutoff_task
+    for cutoff_task in cutoff_tasks:
+        await cutoff_task
+    await mqtt_task
 
 
 async def catch_error(awaitable):
@@ -63,4 +82,9 @@ async def catch_error(awaitable):
 
 
 def main():
-    asyncio.run(catch_error(app()))
+    try:
+        asyncio.run(catch_error(app()))
+    finally:
+        # Whatever the background tasks didn't get to yet
+        LogStore.flush()
+        LogSink.drain()
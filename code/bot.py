@@ -1,57 +1,136 @@
 import asyncio
+import json
+import os
 import time
 import machine
 
 import aiohttp
 
+from clock import Clock
+from concurrency import Semaphore
 from credentials import Credentials
-from ecoflow import delta2
-from tuya import tuya_switch
-from logger import getLogger
+from devices import registry
+from endpoints import TELEGRAM_URL
+from logger import LogSink, getLogger, log_error
+from logstore import LogStore
+from tuya import TuyaSwitch
 
 log = getLogger("BOT")
 
 
+class BotState:
+    """Bot state kept on flash, so a reboot neither replays commands nor starts over the
+    info message. Saved atomically, and only when it changed."""
+
+    path = "bot_state.json"
+
+    offset = 0  # Next Telegram update to receive
+    info_message_id = None
+    start_time = None
+    start_soc = None
+    resume_info = False  # Set before our own resets, which don't count as power-ons
+
+    _saved = None  # JSON last written
+
+    _FIELDS = ("offset", "info_message_id", "start_time", "start_soc", "resume_info")
+
+    @classmethod
+    def load(cls):
+        try:
+            with open(cls.path) as f:
+                data = f.read()
+            for name, value in json.loads(data).items():
+                if name in cls._FIELDS:
+                    setattr(cls, name, value)
+            cls._saved = data
+        except (OSError, ValueError):
+            pass  # First boot or a broken file, start from scratch
+
+    @classmethod
+    def save(cls):
+        data = json.dumps({name: getattr(cls, name) for name in cls._FIELDS})
+        if data == cls._saved:
+            return
+        try:
+            # Renaming over the old file is atomic on LittleFS
+            with open(cls.path + ".tmp", "w") as f:
+                f.write(data)
+            os.rename(cls.path + ".tmp", cls.path)
+            cls._saved = data
+        except OSError as e:
+            log("Failed to save bot state: %s", e)
+
+
 class TelegramBot:
     long_polling_timeout_s = 60  # long polling timeout
+    poll_grace_s = 10  # on top of the long polling timeout, for a stuck connection
+    min_retry_delay_s = 1
+    max_retry_delay_s = 60
+    logs_reply_chars = 4000  # "Logs" command reply, within Telegram's limit
+
+    # Command text -> (`_cmd_<name>` handler, timeout in seconds or None to run inline).
+    # Other commands run as tasks, so polling goes on while they talk to the clouds.
+    commands = {
+        "/start": ("start", 30),
+        "Status": ("status", 60),
+        "Toggle AC": ("toggle_ac", 60),
+        "Relay OFF": ("relay_off", 60),
+        "Logs": ("logs", 30),
+        "Reset soft": ("reset_soft", None),
+        "Reset hard": ("reset_hard", None),
+        "Stop bot": ("stop_bot", None),
+    }
+    max_running_commands = 2
+
+    _command_limiter = Semaphore(max_running_commands)
 
     should_stop = False
 
-    _session = aiohttp.ClientSession(
-        f"https://api.telegram.org/bot{Credentials.tg_bot_token}"
-    )
-    _offset = 0
+    _session = aiohttp.ClientSession(f"{TELEGRAM_URL}/bot{Credentials.tg_bot_token}")
 
     @classmethod
     async def get_updates(cls):
         async with cls._session.get(
             "/getUpdates",
             json={
-                "offset": cls._offset,
+                "offset": BotState.offset,
                 "limit": 10,
                 "timeout": cls.long_polling_timeout_s,
                 "allowed_updates": ["message"],
             },
         ) as response:
             jo = await response.json()
-            updates = jo.get("result", [])
-            return updates
+        if not jo.get("ok"):
+            raise ValueError(f"Failed to get updates: {jo}")
+        return jo["result"]
 
     @classmethod
     async def listen(cls):
         log("POWERON")
 
+        retry_delay_s = cls.min_retry_delay_s
         while True:
-            updates = await cls.get_updates()
+            try:
+                updates = await asyncio.wait_for(
+                    cls.get_updates(), cls.long_polling_timeout_s + cls.poll_grace_s
+                )
+            except (ValueError, asyncio.TimeoutError) as e:
+                # OSError is left to WiFi.ensure_wifi
+                log("Polling failed: %s, retrying in %ds", e, retry_delay_s)
+                await asyncio.sleep(retry_delay_s)
+                retry_delay_s = min(retry_delay_s * 2, cls.max_retry_delay_s)
+                continue
+            retry_delay_s = cls.min_retry_delay_s
 
             for update in updates:
-                cls._offset = update["update_id"] + 1
+                BotState.offset = update["update_id"] + 1
 
                 await cls.handle_update(update)
                 if cls.should_stop:
                     return
+            BotState.save()
 
-            await asyncio.sleep(1)
+            # The next poll waits for new messages on the server, so no pause here
 
     @classmethod
     async def send_info(cls):
@@ -85,12 +164,46 @@ class TelegramBot:
             info += f"\n({format_interval(now_time - start_time)})"
             return info
 
-        start_soc = await delta2.soc()
-        start_time = time.time()
+        delta2 = registry.primary.delta2
+        resume = BotState.info_message_id is not None and (
+            BotState.resume_info or machine.reset_cause() != machine.PWRON_RESET
+        )
+
+        if resume:
+            # Rebooted without a power cut, keep updating the same message
+            start_soc = BotState.start_soc
+            start_time = BotState.start_time
+            info_message_id = BotState.info_message_id
+            current_info = format_info(
+                start_time, start_soc, time.time(), await delta2.soc()
+            )
+            try:
+                await cls.edit_message(
+                    Credentials.tg_info_chat_id, info_message_id, current_info
+                )
+            except ValueError as e:
+                # Same text as before the reboot is fine, a deleted message is not
+                if "not modified" not in str(e):
+                    log("Can't continue the info message, sending a new one: %s", e)
+                    BotState.info_message_id = None
+                    BotState.save()
+                    resume = False
+
+        if not resume:
+            start_soc = await delta2.soc()
+            start_time = time.time()
+
+            current_info = format_info(start_time, start_soc, start_time, start_soc)
+            info_message = await cls.send_text(
+                Credentials.tg_info_chat_id, current_info
+            )
+            info_message_id = info_message["message_id"]
 
-        current_info = format_info(start_time, start_soc, start_time, start_soc)
-        info_message = await cls.send_text(Credentials.tg_info_chat_id, current_info)
-        info_message_id = info_message["message_id"]
+        BotState.info_message_id = info_message_id
+        BotState.start_time = start_time
+        BotState.start_soc = start_soc
+        BotState.resume_info = False
+        BotState.save()
 
         while True:
             await asyncio.sleep(60)  # every minute
@@ -148,87 +261,140 @@ class TelegramBot:
             if str(chat_id) == str(Credentials.tg_info_chat_id):
                 return  # Ignore messages from info chat
 
-            log(f"Ignored message from chat_id = '{chat_id}'")
+            log("Ignored message from chat_id = '%s'", chat_id)
             return
 
         text = message.get("text", "")
-        if text == "/start":
-            log(f"Received {text} command")
-            await cls.send_text(
-                Credentials.tg_admin_chat_id,
-                "Sending you the keyboard.",
-                reply_markup={
-                    "keyboard": [
-                        [{"text": "Status"}],
-                        [{"text": "Toggle AC"}],
-                        [{"text": "Relay OFF"}],
-                        [{"text": "Reset soft"}],
-                        [{"text": "Reset hard"}],
-                        [{"text": "Stop bot"}],
-                    ],
-                    "one_time_keyboard": True,
-                },
-            )
+        command = cls.commands.get(text)
+        if command is None:
+            log("Unknown command: %s", text)
+            return
 
-        elif text == "Status":
-            log(f"Received {text} command")
+        log("Received %s command", text)
+        name, timeout_s = command
+        handler = getattr(cls, f"_cmd_{name}")
+        if timeout_s is None:
+            await handler(update)
+        else:
+            asyncio.create_task(cls._run_command(text, handler, timeout_s, update))
 
-            is_online = await delta2.is_online()
-            log(f"Device is {'online ✅️' if is_online else 'offline ❌'}")
+    @classmethod
+    async def _run_command(cls, text, handler, timeout_s, update):
+        received_at = time.ticks_ms()
+        try:
+            async with cls._command_limiter:
+                await asyncio.wait_for(handler(update), timeout_s)
+        except asyncio.TimeoutError:
+            log("%s command timed out after %ds", text, timeout_s)
+            return
+        except Exception as e:
+            log_error(e)
+            return
 
-            params = await delta2._api.get_params([
-                "mppt.cfgAcEnabled",
-                "bms_emsStatus.chgLinePlug",
-                "bms_bmsStatus.chgState",
-                "pd.remainTime",
-                "bms_bmsStatus.soc",
-            ])
+        # Telegram dates messages in whole seconds
+        sent_at = update["message"].get("date", 0)
+        log(
+            "%s command done in %dms, %ds after it was sent",
+            text,
+            time.ticks_diff(time.ticks_ms(), received_at),
+            Clock.get_unix_time_ms() // 1000 - sent_at,
+        )
+
+    @classmethod
+    async def _cmd_start(cls, update):
+        await cls.send_text(
+            Credentials.tg_admin_chat_id,
+            "Sending you the keyboard.",
+            reply_markup={
+                "keyboard": [
+                    [{"text": "Status"}],
+                    [{"text": "Toggle AC"}],
+                    [{"text": "Relay OFF"}],
+                    [{"text": "Logs"}],
+                    [{"text": "Reset soft"}],
+                    [{"text": "Reset hard"}],
+                    [{"text": "Stop bot"}],
+                ],
+                "one_time_keyboard": True,
+            },
+        )
+
+    @classmethod
+    async def _cmd_status(cls, update):
+        for pair in registry.pairs:
+            is_online = await pair.delta2.is_online()
+            log("%s is %s", pair.name, "online ✅️" if is_online else "offline ❌")
+
+            telemetry = await pair.delta2.telemetry()
             text = (
-                f"Device status:\n"
-                f"AC: {'✅️' if params['mppt.cfgAcEnabled'] == 1 else '❌'}\n"
-                f"Charging line: {'✅️' if params['bms_emsStatus.chgLinePlug'] == 1 else '❌'}\n"
-                f"Charging: {'✅️' if params['bms_bmsStatus.chgState'] != 0 else '❌'}\n"
-                f"Remaining time: {params['pd.remainTime']} minutes\n"
-                f"SOC: {params['bms_bmsStatus.soc']}%"
+                f"{pair.name} status:\n"
+                f"AC: {'✅️' if telemetry.ac_enabled else '❌'}\n"
+                f"Charging line: {'✅️' if telemetry.charging_line_plugged else '❌'}\n"
+                f"Charging: {'✅️' if telemetry.is_charging else '❌'}\n"
+                f"Remaining time: {telemetry.remaining_time_minutes} minutes\n"
+                f"SOC: {telemetry.bms_soc}%"
             )
             log(text)
 
-        elif text == "Relay OFF":
-            log(f"Received {text} command")
-            log("Turning the relay off... Goodbye!)")
-            await tuya_switch.set_switch(False)
+    @classmethod
+    async def _cmd_relay_off(cls, update):
+        log("Turning the relays off... Goodbye!)")
+        switches = [pair.switch for pair in registry.pairs]
+        results = await TuyaSwitch.set_switches(switches, False)
+        try:
+            states = await TuyaSwitch.get_switches(switches)
+        except Exception as e:
+            # The cloud may be down while LAN control worked, report the results anyway
+            log("Failed to read the relay states: %s", e)
+            states = {}
+        for pair in registry.pairs:
+            result = results[pair.switch.device_id]
+            if isinstance(result, Exception):
+                log("%s: Failed to turn the relay off: %s", pair.name, result)
+            elif states.get(pair.switch.device_id) is False:
+                log("%s: Relay is off ✅️", pair.name)
+            else:
+                log("%s: Relay state is not confirmed yet", pair.name)
+
+    @classmethod
+    async def _cmd_logs(cls, update):
+        history = LogStore.tail(cls.logs_reply_chars)
+        await cls.send_text(Credentials.tg_admin_chat_id, history or "No logs yet")
 
-        elif text == "Toggle AC":
-            log(f"Received {text} command")
-            is_ac_enabled = await delta2.get_ac_enabled()
+    @classmethod
+    async def _cmd_toggle_ac(cls, update):
+        for pair in registry.pairs:
+            is_ac_enabled = await pair.delta2.get_ac_enabled()
             if is_ac_enabled:
-                await delta2.set_ac_enabled(False)
-                log("Disabled AC ❌")
+                await pair.delta2.set_ac_enabled(False)
+                log("%s: Disabled AC ❌", pair.name)
             else:
-                await delta2.set_ac_enabled(True)
-                log("Enabled AC ✅️")
-
-        elif text == "Reset soft" or text == "Reset hard" or text == "Stop bot":
-            log(f"Received {text} command")
-            offset = update["update_id"] + 1
-            async with cls._session.get(
-                "/getUpdates",  # clear up current message
-                json={
-                    "offset": offset,
-                    "limit": 1,
-                    "allowed_updates": ["message"],
-                },
-            ):
-                pass
-
-            if text == "Reset soft":
-                log("Soft resetting machine...")
-                machine.soft_reset()
-
-            elif text == "Reset hard":
-                log("Hard resetting machine...")
-                machine.reset()
-
-            elif text == "Stop bot":
-                log(f"Received {text} command")
-                cls.should_stop = True
+                await pair.delta2.set_ac_enabled(True)
+                log("%s: Enabled AC ✅️", pair.name)
+
+    @classmethod
+    def _prepare_reset(cls):
+        # The offset is past this command already, so it isn't received again
+        BotState.resume_info = True
+        BotState.save()
+
+        # The background log tasks won't get to run anymore
+        LogStore.flush()
+        LogSink.drain()
+
+    @classmethod
+    async def _cmd_reset_soft(cls, update):
+        log("Soft resetting machine...")
+        cls._prepare_reset()
+        machine.soft_reset()
+
+    @classmethod
+    async def _cmd_reset_hard(cls, update):
+        log("Hard resetting machine...")
+        cls._prepare_reset()
+        machine.reset()
+
+    @classmethod
+    async def _cmd_stop_bot(cls, update):
+        BotState.save()
+        cls.should_stop = True
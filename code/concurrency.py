@@ -0,0 +1,63 @@
+"""Concurrency helpers missing from MicroPython's asyncio."""
+
+import asyncio
+
+
+class Semaphore:
+    """Limits the number of tasks inside an `async with` block at the same time."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: list = []
+
+    async def acquire(self):
+        while self._value <= 0:
+            event = asyncio.Event()
+            self._waiters.append(event)
+            try:
+                await event.wait()
+            except asyncio.CancelledError:
+                if event in self._waiters:
+                    self._waiters.remove(event)
+                elif self._value > 0:
+                    self._wake_next()  # Pass on the wakeup we were given
+                raise
+        self._value -= 1
+
+    def release(self):
+        self._value += 1
+        self._wake_next()
+
+    def _wake_next(self):
+        if self._waiters:
+            self._waiters.pop(0).set()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
+
+
+# Every cloud API request opens its own TLS connection, each one costing tens of KB of RAM.
+# Shared by all Ecoflow and Tuya clients.
+tls_limiter = Semaphore(2)
+
+
+async def gather_limited(limit: int, awaitables: dict) -> dict:
+    """Awaits `{key: awaitable}` with at most `limit` of them in flight at once.
+
+    Returns `{key: result}`, where a failed awaitable's result is its exception.
+    """
+    semaphore = Semaphore(limit)
+
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    keys = list(awaitables)
+    results = await asyncio.gather(
+        *(run(awaitables[key]) for key in keys), return_exceptions=True
+    )
+    return dict(zip(keys, results))
@@ -0,0 +1,80 @@
+"""Registry of the (Delta2, Tuya relay) pairs controlled by this board.
+
+Pairs are read from the optional `Credentials.devices` list:
+
+```
+devices = [
+    {"name": "Kitchen", "ecoflow_sn": "R331...", "tuya_device_id": "bf12..."},
+    {"name": "Office", "ecoflow_sn": "R331...", "tuya_device_id": "bf34..."},
+]
+```
+
+Without it, a single pair is built from `Credentials.ecoflow_sn` and `Credentials.tuya_device_id`.
+
+Relays are switched over the local network when `tuya_local_key` and `tuya_ip` are given
+(and optionally `tuya_version`, "3.3" by default), with the cloud API as a fallback.
+For a single pair they are read from `Credentials` as well.
+All pairs share the Ecoflow/Tuya sessions, the Tuya access token, one MQTT connection
+and the TLS connection limit (see `concurrency.tls_limiter`).
+"""
+
+from credentials import Credentials
+from ecoflow import Delta2, EcoflowDeviceApi, EcoflowQuotaSubscriber
+import tuya
+from tuya import TuyaSwitch
+from tuya_local import TuyaLocalDevice
+
+
+class DevicePair:
+    def __init__(self, name: str, delta2: Delta2, switch: TuyaSwitch):
+        self.name = name
+        self.delta2 = delta2
+        self.switch = switch
+
+
+class DeviceRegistry:
+    def __init__(self, pairs: list[DevicePair]):
+        self.pairs = pairs
+        self.quota_subscriber = EcoflowQuotaSubscriber(
+            [pair.delta2._api for pair in pairs]
+        )
+
+    @classmethod
+    def from_credentials(cls):
+        configs = getattr(Credentials, "devices", None) or [
+            {
+                "name": "Delta2",
+                "ecoflow_sn": Credentials.ecoflow_sn,
+                "tuya_device_id": Credentials.tuya_device_id,
+                "tuya_local_key": getattr(Credentials, "tuya_local_key", None),
+                "tuya_ip": getattr(Credentials, "tuya_ip", None),
+                "tuya_version": getattr(Credentials, "tuya_version", "3.3"),
+            }
+        ]
+
+        pairs = []
+        for config in configs:
+            device_api = EcoflowDeviceApi(
+                access_key=Credentials.ecoflow_access_key,
+                secret_key=Credentials.ecoflow_secret_key,
+                sn=config["ecoflow_sn"],
+            )
+            local = None
+            if config.get("tuya_local_key") and config.get("tuya_ip"):
+                local = TuyaLocalDevice(
+                    config["tuya_device_id"],
+                    config["tuya_local_key"],
+                    config["tuya_ip"],
+                    config.get("tuya_version", "3.3"),
+                )
+            switch = TuyaSwitch(tuya.api, config["tuya_device_id"], local)
+            pairs.append(DevicePair(config["name"], Delta2(device_api), switch))
+        return cls(pairs)
+
+    @property
+    def primary(self) -> DevicePair:
+        """The first pair, used where a single device is reported (e.g. the info message)."""
+        return self.pairs[0]
+
+
+registry = DeviceRegistry.from_credentials()
@@ -1,22 +1,42 @@
-import hmac
+import asyncio
+import json
 import random
-from collections import OrderedDict
+import time
 
 import aiohttp
 
 from clock import Clock
-from credentials import Credentials
+from concurrency import tls_limiter
+from endpoints import ECOFLOW_URL
+from logger import getLogger
+from mqtt import MqttClient
+from signer import HmacSha256Signer
+
+log = getLogger("ECOFLOW")
+
+
+class _PendingResult:
+    """Result of a request shared by several waiting tasks."""
+
+    def __init__(self):
+        self.values = None
+        self.error = None
+        self.done = asyncio.Event()
 
 
 class EcoflowApi:
-    _session = aiohttp.ClientSession("https://api.ecoflow.com/iot-open/sign/device")
+    _session = aiohttp.ClientSession(ECOFLOW_URL)
 
     class EcoflowApiException(Exception):
         pass
 
+    # Max number of request shapes to keep precompiled canonical strings for
+    canonical_cache_size = 16
+
     def __init__(self, access_key: str, secret_key: str):
         self._access_key = access_key
-        self._secret_key = secret_key
+        self._signer = HmacSha256Signer(secret_key.encode())
+        self._canonical_cache: dict = {}
 
     @staticmethod
     def _flatten_json_body(json_value, into_dict: dict, full_key=""):
@@ -42,13 +62,8 @@ class EcoflowApi:
         else:
             raise ValueError("Wrong query parameter type:", type(json_value))
 
-    def _stringify_query(
-        self,
-        nonce: int,
-        timestamp: int,
-        json_body=None,
-        query_params=None,
-    ) -> str:
+    def _canonical_prefix(self, json_body=None, query_params=None) -> str:
+        """Builds the canonical query string up to (but excluding) the nonce value."""
         # Collect all params from json body
         all_params: dict[str, str] = dict()
         self._flatten_json_body(json_body or {}, all_params)
@@ -56,28 +71,41 @@ class EcoflowApi:
         # Add optional explicit query params:
         all_params.update(query_params or {})
 
-        # Sort alphabetically
-        # noinspection PyTypeChecker
-        all_params = OrderedDict(sorted(OrderedDict(all_params).items()))
-
-        # Add mandatory params
-        all_params["accessKey"] = self._access_key
-        all_params["nonce"] = str(nonce)
-        all_params["timestamp"] = str(timestamp)
-
-        # Convert to query string
+        # Sort alphabetically and convert to query string
         quoted_params_list = []
-        for key, value in all_params.items():
+        for key, value in sorted(all_params.items()):
             quoted_params_list.append(key + "=" + str(value))
-        query_str = "&".join(quoted_params_list)
 
-        return query_str
+        # Add mandatory params, nonce and timestamp are appended per request
+        quoted_params_list.append("accessKey=" + self._access_key)
+        quoted_params_list.append("nonce=")
+        return "&".join(quoted_params_list)
+
+    def _stringify_query(
+        self,
+        nonce: int,
+        timestamp: int,
+        json_body=None,
+        query_params=None,
+        cache_key=None,
+    ) -> str:
+        """`cache_key` must identify the body and query params completely,
+        in which case their canonical form is computed only once."""
+        prefix = None
+        if cache_key is not None:
+            prefix = self._canonical_cache.get(cache_key)
+
+        if prefix is None:
+            prefix = self._canonical_prefix(json_body, query_params)
+            if cache_key is not None:
+                if len(self._canonical_cache) >= self.canonical_cache_size:
+                    self._canonical_cache.clear()
+                self._canonical_cache[cache_key] = prefix
+
+        return prefix + str(nonce) + "&timestamp=" + str(timestamp)
 
     def _sign_query(self, query_str: str) -> str:
-        digest = hmac.new(
-            self._secret_key.encode(), msg=query_str.encode(), digestmod="sha256"
-        )
-        digest_hex = digest.hexdigest()
+        digest_hex = self._signer.hexdigest(query_str.encode())
         return digest_hex
 
     class DeviceOffline(EcoflowApiException):
@@ -89,6 +117,7 @@ class EcoflowApi:
         api_func: str,
         json_body=None,
         query_params=None,
+        sign_cache_key=None,
     ) -> dict:
         url = f"/{api_func}"
 
@@ -98,7 +127,9 @@ class EcoflowApi:
         nonce = random.randint(100000, 999999)
         timestamp = Clock.get_unix_time_ms()
 
-        query_str = self._stringify_query(nonce, timestamp, json_body, query_params)
+        query_str = self._stringify_query(
+            nonce, timestamp, json_body, query_params, sign_cache_key
+        )
         sign = self._sign_query(query_str)
 
         headers = {
@@ -108,54 +139,201 @@ class EcoflowApi:
             "sign": sign,
         }
 
-        async with self._session.request(
-            method.upper(), url, headers=headers, json=json_body
-        ) as response:
-            result_json: dict = await response.json()
+        # Serialize the body ourselves, so it's done exactly once
+        body = None
+        if json_body:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+
+        async with tls_limiter:
+            async with self._session.request(
+                method.upper(), url, headers=headers, data=body
+            ) as response:
+                result_json: dict = await response.json()
 
         if result_json.get("code") == "1000":
+            # Our online statuses are outdated, fetch them again on the next check
+            self._device_tables.pop(self._access_key, None)
             raise self.DeviceOffline
-        assert result_json.get("code") == "0", result_json
-        assert result_json.get("message") == "Success", result_json
+        # Not asserts, those are stripped from optimized builds
+        if result_json.get("code") != "0" or result_json.get("message") != "Success":
+            raise self.EcoflowApiException(result_json)
         data = result_json.get("data", None)
         return data or {}
 
+    # In-flight device list requests by access key, shared by concurrent callers
+    _devices_list_pending: dict = {}
+
     async def get_devices_list(self):
-        devices = await self._make_request("get", "list")
-        return devices or []
+        pending = self._devices_list_pending.get(self._access_key)
+        if pending is None:
+            pending = self._devices_list_pending[self._access_key] = _PendingResult()
+            # In its own task, so cancelling the first caller doesn't fail the others
+            asyncio.create_task(self._fetch_devices_list(pending))
+        await pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.values
+
+    async def _fetch_devices_list(self, pending: _PendingResult):
+        try:
+            devices = await self._make_request(
+                "get", "device/list", sign_cache_key="list"
+            )
+            pending.values = devices or []
+        except Exception as e:
+            pending.error = e
+        finally:
+            del self._devices_list_pending[self._access_key]
+            pending.done.set()
+
+    # The devices list is downloaded at most this often, shared by all callers
+    devices_list_max_age_s: float = 30
+    # Online status index by access key: (ticks_ms when fetched, {sn: online})
+    _device_tables: dict = {}
+
+    async def get_online_statuses(self, fresh: bool = False) -> dict:
+        """Returns online status by serial number for all devices linked to the account."""
+        table = self._device_tables.get(self._access_key)
+        if (
+            fresh
+            or table is None
+            or time.ticks_diff(time.ticks_ms(), table[0])
+            > self.devices_list_max_age_s * 1000
+        ):
+            devices = await self.get_devices_list()
+            table = (
+                time.ticks_ms(),
+                {device["sn"]: bool(device["online"]) for device in devices},
+            )
+            self._device_tables[self._access_key] = table
+        return table[1]
+
+    async def get_mqtt_certification(self) -> dict:
+        """Returns MQTT credentials: certificateAccount, certificatePassword, url, port, protocol."""
+        data = await self._make_request(
+            "get", "certification", sign_cache_key="certification"
+        )
+        return data
+
+
+class _QuotaBatch(_PendingResult):
+    """Parameter names requested within one coalescing window, and the shared result."""
+
+    def __init__(self):
+        super().__init__()
+        self.names: list = []
+        self.values: dict = {}
 
 
 class EcoflowDeviceApi(EcoflowApi):
+    # Quota values read over HTTP are reused for this long
+    quota_max_age_s: float = 5
+    # Concurrent quota reads within this window are sent as one request
+    quota_batch_window_s: float = 0.02
+
     def __init__(self, access_key: str, secret_key: str, sn: str):
         super().__init__(access_key, secret_key)
         self._sn = sn
 
+        # Latest known quota values and when they were stored (ticks_ms).
+        # Filled by HTTP reads and by MQTT pushes (see EcoflowQuotaSubscriber).
+        self._quotas: dict = {}
+        self._quotas_updated_at: dict = {}
+        # While pushes arrive, values of the pushed params are kept up to date and never expire
+        self._push_connected = False
+        self._pushed_names: tuple = ()
+        # Batch currently collecting parameter names, None if no request is pending
+        self._quota_batch = None
+
+    def _store_quotas(self, values: dict):
+        now = time.ticks_ms()
+        for name, value in values.items():
+            self._quotas[name] = value
+            self._quotas_updated_at[name] = now
+
+    def _cached_quotas(self, param_names: list):
+        """Returns cached values for all `param_names`, or None if any is missing or stale."""
+        quotas = self._quotas
+        updated_at = self._quotas_updated_at
+        max_age_ms = self.quota_max_age_s * 1000
+        now = time.ticks_ms()
+        values = {}
+        for name in param_names:
+            if name not in quotas:
+                return None
+            if time.ticks_diff(now, updated_at[name]) > max_age_ms and not (
+                self._push_connected and name in self._pushed_names
+            ):
+                return None
+            values[name] = quotas[name]
+        return values
+
     class DeviceNotLinked(EcoflowApi.EcoflowApiException):
         pass
 
-    async def is_online(self) -> bool:
-        devices = await self.get_devices_list()
-        for device in devices:
-            if device["sn"] == self._sn:
-                online = bool(device["online"])
-                return online
-        raise self.DeviceNotLinked
+    async def is_online(self, fresh: bool = False) -> bool:
+        statuses = await self.get_online_statuses(fresh)
+        if self._sn not in statuses:
+            raise self.DeviceNotLinked
+        return statuses[self._sn]
 
     async def get_all_params(self) -> dict:
         data = await self._make_request(
-            "get", "quota/all", query_params={"sn": self._sn}
+            "get",
+            "device/quota/all",
+            query_params={"sn": self._sn},
+            sign_cache_key="quota/all",
         )
         return data
 
-    async def get_params(self, param_names: list):
+    async def get_params(self, param_names: list, fresh: bool = False):
+        """Returns the requested quota values, from cache unless `fresh` is set."""
+        if not fresh:
+            cached = self._cached_quotas(param_names)
+            if cached is not None:
+                return cached
+
+        # Join the pending batch (or start one), so near-simultaneous reads
+        # from different tasks share a single quota request
+        batch = self._quota_batch
+        if batch is None:
+            batch = self._quota_batch = _QuotaBatch()
+            asyncio.create_task(self._send_quota_batch(batch))
+        for name in param_names:
+            if name not in batch.names:
+                batch.names.append(name)
+
+        await batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return {name: batch.values[name] for name in param_names if name in batch.values}
+
+    async def _send_quota_batch(self, batch: _QuotaBatch):
+        await asyncio.sleep(self.quota_batch_window_s)
+        self._quota_batch = None  # Later callers start a new batch
+
         json_body = {
             "sn": self._sn,
             "params": {
-                "quotas": param_names,
+                "quotas": batch.names,
             },
         }
-        data = await self._make_request("post", "quota", json_body=json_body)
-        return data
+        try:
+            data = await self._make_request(
+                "post",
+                "device/quota",
+                json_body=json_body,
+                sign_cache_key=tuple(batch.names),
+            )
+            # Keyed by the callers' name objects, so the parsed JSON keys can be freed
+            batch.values = {name: data[name] for name in batch.names if name in data}
+            self._store_quotas(batch.values)
+        except Exception as e:
+            # Delivered to every waiting caller
+            batch.error = e
+        batch.done.set()
 
     class ModuleType:
         PD = 1
@@ -171,7 +349,234 @@ class EcoflowDeviceApi(EcoflowApi):
             "operateType": operate_type,
             "params": params,
         }
-        await self._make_request("put", "quota", json_body)
+        await self._make_request("put", "device/quota", json_body)
+
+        # Cached values may predate the write, read over HTTP until fresh ones arrive
+        self._quotas.clear()
+        self._quotas_updated_at.clear()
+
+
+class Delta2Params:
+    """Quota parameter identifiers.
+
+    Always refer to params through these constants, so that the cache, pushes and
+    telemetry all use the same names.
+    """
+
+    AC_ENABLED = "mppt.cfgAcEnabled"
+    CHARGING_LINE_PLUGGED = "bms_emsStatus.chgLinePlug"
+    CHARGE_STATE = "bms_bmsStatus.chgState"
+    REMAINING_TIME = "pd.remainTime"
+    SOC = "pd.soc"
+    BMS_SOC = "bms_bmsStatus.soc"
+
+    # Everything `Delta2Telemetry` is built from
+    TELEMETRY = (
+        AC_ENABLED,
+        CHARGING_LINE_PLUGGED,
+        CHARGE_STATE,
+        REMAINING_TIME,
+        SOC,
+        BMS_SOC,
+    )
+    # What Logic polls while the battery charges
+    CHARGE_PROGRESS = (CHARGE_STATE, REMAINING_TIME, SOC)
+
+
+class EcoflowQuotaSubscriber:
+    """Keeps one MQTT-over-TLS connection to Ecoflow open and stores the pushed quota values
+    in each `EcoflowDeviceApi`, so that `get_params` can be served from memory.
+    While disconnected, `get_params` falls back to HTTP polling.
+
+    Only `param_names` are kept, the rest of each push is dropped to save heap.
+    All devices must belong to the same Ecoflow account."""
+
+    # Reconnects and retries of offline devices back off exponentially between these
+    reconnect_delay_s = 10
+    max_reconnect_delay_s = 300
+    keepalive_s = 60
+
+    # Pushed messages group values by `typeCode` and omit the prefix used by quota keys
+    type_code_prefixes = {
+        "pdStatus": "pd",
+        "mpptStatus": "mppt",
+        "bmsStatus": "bms_bmsStatus",
+        "emsStatus": "bms_emsStatus",
+        "invStatus": "inv",
+    }
+
+    def __init__(
+        self, apis: list[EcoflowDeviceApi], param_names: tuple = Delta2Params.TELEMETRY
+    ):
+        self._apis = apis
+        self._param_names = param_names
+        self._certification = None
+        self._connected = None  # Unknown until the first attempt
+        self._unseeded: list = []  # Offline devices, their pushes aren't trusted yet
+        self._offline_sns: set = set()  # Devices reported offline to the admin
+        self._seed_now = asyncio.Event()
+
+        # typeCode -> pushed key -> param name
+        self._push_keys: dict = {}
+        type_codes = {prefix: code for code, prefix in self.type_code_prefixes.items()}
+        for name in param_names:
+            prefix, key = name.split(".", 1)
+            self._push_keys.setdefault(type_codes[prefix], {})[key] = name
+
+    async def run(self):
+        delay_s = self.reconnect_delay_s
+        while True:
+            try:
+                await self._run_connection()
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                MqttClient.MqttException,
+                EcoflowApi.EcoflowApiException,
+            ) as e:
+                reason = f"{type(e).__name__} {e}"
+                if self._connected is False:
+                    print(f"MQTT connection failed: {reason}")
+                else:
+                    # Only the change of state goes to the admin
+                    log("MQTT connection lost: %s, reconnecting...", reason)
+                    delay_s = self.reconnect_delay_s
+            finally:
+                for api in self._apis:
+                    api._push_connected = False
+
+            self._connected = False
+            print(f"Reconnecting to MQTT in {delay_s}s...")
+            await asyncio.sleep(delay_s)
+            delay_s = min(delay_s * 2, self.max_reconnect_delay_s)
+
+    async def _run_connection(self):
+        if self._certification is None:
+            self._certification = await self._apis[0].get_mqtt_certification()
+        account = self._certification["certificateAccount"]
+
+        client = MqttClient(
+            client_id=f"{account}_{random.getrandbits(32):08x}",
+            user=account,
+            password=self._certification["certificatePassword"],
+            keepalive_s=self.keepalive_s,
+        )
+        try:
+            await client.connect(
+                self._certification["url"],
+                int(self._certification["port"]),
+                ssl=self._certification.get("protocol", "mqtts") == "mqtts",
+            )
+        except MqttClient.MqttException:
+            self._certification = None  # Credentials might have been revoked
+            raise
+
+        try:
+            apis_by_topic = {}
+            for api in self._apis:
+                topic = f"/open/{account}/{api._sn}/quota"
+                apis_by_topic[topic] = api
+                await client.subscribe(topic)
+
+            # Seed the values, pushes only carry the groups that changed
+            self._unseeded = list(self._apis)
+            for api in self._apis:
+                await self._seed(api)
+            self._connected = True
+            log("Subscribed to MQTT quota updates")
+
+            retry_task = asyncio.create_task(self._retry_seeds())
+            try:
+                while True:
+                    topic, payload = await client.receive()
+                    api = apis_by_topic.get(topic)
+                    if api is not None:
+                        self._store(api, payload)
+                        if api in self._unseeded:
+                            self._seed_now.set()  # It's back online
+            finally:
+                retry_task.cancel()
+        finally:
+            await client.close()
+
+    async def _seed(self, api: EcoflowDeviceApi):
+        """Seeds the device's values over HTTP, offline devices are left to later tries."""
+        try:
+            data = await api.get_all_params()
+        except EcoflowApi.DeviceOffline:
+            if api._sn not in self._offline_sns:
+                self._offline_sns.add(api._sn)
+                log("%s is offline, waiting for it to come back", api._sn)
+            return
+
+        api._store_quotas(
+            {name: data[name] for name in self._param_names if name in data}
+        )
+        api._pushed_names = self._param_names
+        api._push_connected = True
+        self._unseeded.remove(api)
+        if api._sn in self._offline_sns:
+            self._offline_sns.remove(api._sn)
+            log("%s is back online", api._sn)
+
+    async def _retry_seeds(self):
+        delay_s = self.reconnect_delay_s
+        while self._unseeded:
+            self._seed_now.clear()
+            try:
+                await asyncio.wait_for(self._seed_now.wait(), delay_s)
+            except asyncio.TimeoutError:
+                pass
+
+            for api in list(self._unseeded):
+                try:
+                    await self._seed(api)
+                except (OSError, asyncio.TimeoutError, EcoflowApi.EcoflowApiException):
+                    pass  # Tried again later, the connection itself is still fine
+            delay_s = min(delay_s * 2, self.max_reconnect_delay_s)
+
+    def _store(self, api: EcoflowDeviceApi, payload: bytes):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        params = message.get("params")
+        push_keys = self._push_keys.get(message.get("typeCode"))
+        if not params or push_keys is None:
+            return
+        api._store_quotas(
+            {name: params[key] for key, name in push_keys.items() if key in params}
+        )
+
+
+class Delta2Telemetry:
+    """One sample of the Delta2 values used by Logic and the bot, built from a quota response.
+
+    Fields of the params that weren't requested are None.
+    """
+
+    __slots__ = (
+        "ac_enabled",
+        "charging_line_plugged",
+        "is_charging",
+        "remaining_time_minutes",
+        "soc",
+        "bms_soc",
+    )
+
+    def __init__(self, quotas: dict):
+        value = quotas.get(Delta2Params.AC_ENABLED)
+        self.ac_enabled = None if value is None else value == 1
+        value = quotas.get(Delta2Params.CHARGING_LINE_PLUGGED)
+        self.charging_line_plugged = None if value is None else value == 1
+        value = quotas.get(Delta2Params.CHARGE_STATE)
+        self.is_charging = None if value is None else value != 0
+        value = quotas.get(Delta2Params.REMAINING_TIME)
+        self.remaining_time_minutes = None if value is None else int(value)
+        value = quotas.get(Delta2Params.SOC)
+        self.soc = None if value is None else int(value)
+        value = quotas.get(Delta2Params.BMS_SOC)
+        self.bms_soc = None if value is None else int(value)
 
 
 class Delta2:
@@ -182,9 +587,9 @@ class Delta2:
         online = await self._api.is_online()
         return online
 
-    async def get_ac_enabled(self) -> bool:
-        param = "mppt.cfgAcEnabled"
-        data = await self._api.get_params([param])
+    async def get_ac_enabled(self, fresh: bool = False) -> bool:
+        param = Delta2Params.AC_ENABLED
+        data = await self._api.get_params([param], fresh)
         value = data[param]
         return value == 1
 
@@ -200,48 +605,33 @@ class Delta2:
             },
         )
 
-    async def charging_line_plugged(self) -> bool:
-        param = "bms_emsStatus.chgLinePlug"
-        data = await self._api.get_params([param])
+    async def charging_line_plugged(self, fresh: bool = False) -> bool:
+        param = Delta2Params.CHARGING_LINE_PLUGGED
+        data = await self._api.get_params([param], fresh)
         value = data[param]
         return value == 1
 
-    async def is_charging(self) -> bool:
-        param = "bms_bmsStatus.chgState"
-        data = await self._api.get_params([param])
+    async def is_charging(self, fresh: bool = False) -> bool:
+        param = Delta2Params.CHARGE_STATE
+        data = await self._api.get_params([param], fresh)
         value = data[param]
         return value != 0
 
-    async def remaining_time_minutes(self) -> int:
-        param = "pd.remainTime"
-        data = await self._api.get_params([param])
+    async def remaining_time_minutes(self, fresh: bool = False) -> int:
+        param = Delta2Params.REMAINING_TIME
+        data = await self._api.get_params([param], fresh)
         value = int(data[param])
         return value
 
-    async def soc(self) -> int:
-        param = "pd.soc"
-        data = await self._api.get_params([param])
+    async def soc(self, fresh: bool = False) -> int:
+        param = Delta2Params.SOC
+        data = await self._api.get_params([param], fresh)
         value = int(data[param])
         return value
 
-    async def battery_status(self) -> dict:
-        params = [
-            "bms_bmsStatus.chgState",
-            "pd.remainTime",
-            "pd.soc",
-        ]
-        data = await self._api.get_params(params)
-        values = {
-            "is_charging": data["bms_bmsStatus.chgState"] != 0,
-            "remaining_time_minutes": int(data["pd.remainTime"]),
-            "soc": int(data["pd.soc"]),
-        }
-        return values
-
-
-device_api = EcoflowDeviceApi(
-    access_key=Credentials.ecoflow_access_key,
-    secret_key=Credentials.ecoflow_secret_key,
-    sn=Credentials.ecoflow_sn,
-)
-delta2 = Delta2(device_api)
+    async def telemetry(
+        self, param_names: tuple = Delta2Params.TELEMETRY, fresh: bool = False
+    ) -> Delta2Telemetry:
+        """Reads `param_names` in one go, from the pushed values while MQTT is up."""
+        data = await self._api.get_params(param_names, fresh)
+        return Delta2Telemetry(data)
@@ -0,0 +1,18 @@
+"""Base URLs of the cloud APIs we talk to.
+
+Set `Credentials.simulator_url` (e.g. `"http://192.168.0.10:8080"`) to point all of them
+at the local cloud simulator instead (see `simulator.py` in the repository root).
+"""
+
+from credentials import Credentials
+
+simulator_url = getattr(Credentials, "simulator_url", None)
+
+if simulator_url:
+    ECOFLOW_URL = f"{simulator_url}/ecoflow/iot-open/sign"
+    TUYA_URL = f"{simulator_url}/tuya"
+    TELEGRAM_URL = f"{simulator_url}/telegram"
+else:
+    ECOFLOW_URL = "https://api.ecoflow.com/iot-open/sign"
+    TUYA_URL = "https://openapi.tuyaeu.com"
+    TELEGRAM_URL = "https://api.telegram.org"
@@ -1,12 +1,73 @@
 """This file is intended as a simple and failsafe way of logging messages.
 It doesn't import other files (apart from credentials.py and urequests from standard library),
-and thus is less impacted in case of a bug or error."""
+and thus is less impacted in case of a bug or error. logstore.py, concurrency.py and aiohttp
+are only imported on first use, and lines are still printed if that fails.
+
+Every line is printed to the serial port right away and kept on flash by `LogStore`.
+While the event loop runs, lines are shipped to Telegram in the background by `LogSink`,
+otherwise they are sent immediately.
+"""
+
+import asyncio
+import time
 
-from credentials import Credentials
 import urequests
 
+from credentials import Credentials
+
+# Same switch as in endpoints.py, repeated here to keep this module self-contained
+_simulator_url = getattr(Credentials, "simulator_url", None)
+_telegram_url = (
+    f"{_simulator_url}/telegram" if _simulator_url else "https://api.telegram.org"
+)
+
+# Line priorities, low priority lines are dropped first when the queue is full
+LOW = 0
+HIGH = 1
+
+# Log levels
+DEBUG = 10
+INFO = 20
+ERROR = 40
+_LEVEL_NAMES = {"DEBUG": DEBUG, "INFO": INFO, "ERROR": ERROR}
 
-def getLogger(logger_name: str):
+# Minimum level by logger name, "*" for the rest, e.g. `{"*": "INFO", "BOT": "DEBUG"}`
+_levels = getattr(Credentials, "log_levels", {})
+
+
+class Logger:
+    """Messages are `%`-style templates, formatted only if the level is enabled.
+
+    Debug calls on hot paths go under `if __debug__:`, so that `ota.py sync --compile`
+    strips them from the `.mpy` files altogether.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.level = _LEVEL_NAMES[_levels.get(name, _levels.get("*", "INFO"))]
+
+    def debug(self, template: str, *args):
+        if self.level <= DEBUG:
+            self._emit(template, args, LOW)
+
+    def info(self, template: str, *args):
+        if self.level <= INFO:
+            self._emit(template, args, LOW)
+
+    def error(self, template: str, *args):
+        if self.level <= ERROR:
+            self._emit(template, args, HIGH)
+
+    def __call__(self, template: str, *args):
+        if self.level <= INFO:
+            self._emit(template, args, LOW)
+
+    def _emit(self, template: str, args: tuple, priority: int):
+        text = template % args if args else template
+        _log(f"({self.name}) {text}", priority)
+
+
+def getLogger(logger_name: str) -> Logger:
     """
     Can be used in a following way:
 
@@ -16,15 +77,13 @@ def getLogger(logger_name: str):
     log = getLogger("MyModule")
 
     log("This is a log message.")
+    log.debug("Battery is %d%%", soc)
     ```
 
     Output: `(MyModule) This is a log message.`
     """
 
-    def namedLogger(text: str):
-        _log(f"({logger_name}) {text}")
-
-    return namedLogger
+    return Logger(logger_name)
 
 
 def log_error(e: Exception):
@@ -35,27 +94,100 @@ def log_error(e: Exception):
 
     buf = io.StringIO()
     sys.print_exception(e, buf)  # Traceback and all
+    traceback = buf.getvalue()
+
+    if ErrorFilter.is_repeat(e, traceback):
+        return
+    _log(f"An error occurred:\n```\n{traceback}\n```", HIGH)
+
+
+class ErrorFilter:
+    """Sends each distinct error once, then only periodic counts of its repeats.
+
+    Errors are told apart by type and the innermost traceback line. An error quiet for
+    a whole summary interval is forgotten, so its next occurrence is sent in full again.
+    """
+
+    summary_interval_s = 600
+    max_fingerprints = 16
+
+    # Fingerprint -> [repeats since last report, ticks_ms of last report]
+    _seen: dict = {}
 
-    _log(f"An error occurred:\n```\n{buf.getvalue()}\n```")
+    @classmethod
+    def is_repeat(cls, e: Exception, traceback: str) -> bool:
+        location = ""
+        for line in traceback.splitlines():
+            if line.startswith("  File "):
+                location = line.strip()
+        fingerprint = f"{type(e).__name__} at {location}"
 
+        cls.summarize()
+        entry = cls._seen.get(fingerprint)
+        if entry is not None:
+            entry[0] += 1
+            print(f"Repeated error, not sent: {fingerprint}")
+            return True
 
-def _log(text: str):
-    """Prints the log message to serial port and tries to send it to Telegram bot."""
+        if len(cls._seen) >= cls.max_fingerprints:
+            oldest = min(cls._seen, key=lambda f: cls._seen[f][1])
+            cls._report(oldest, cls._seen.pop(oldest)[0])
+        cls._seen[fingerprint] = [0, time.ticks_ms()]
+        return False
 
-    # First, simply print to serial port
+    @classmethod
+    def summarize(cls):
+        """Reports repeats of the errors whose summary interval is over."""
+        now = time.ticks_ms()
+        for fingerprint in list(cls._seen):
+            entry = cls._seen[fingerprint]
+            if time.ticks_diff(now, entry[1]) < cls.summary_interval_s * 1000:
+                continue
+            if entry[0]:
+                cls._report(fingerprint, entry[0])
+                entry[0] = 0
+                entry[1] = now
+            else:
+                del cls._seen[fingerprint]
+
+    @staticmethod
+    def _report(fingerprint: str, repeats: int):
+        if repeats:
+            _log(f"Error repeated {repeats} more times: {fingerprint}", HIGH)
+
+
+def _log(text: str, priority: int = LOW):
+    """Prints the log message to serial port and ships it to Telegram bot."""
+
+    # First, simply print to serial port and keep on flash
     print(text)
+    try:
+        from logstore import LogStore
+
+        LogStore.put(text, urgent=priority == HIGH)
+    except Exception as e:
+        print(f"Error while keeping log message on flash: {e}")
 
-    # Then, try to send to Telegram
-    body = {
-        "chat_id": Credentials.tg_admin_chat_id,
-        "text": text,
-        "parse_mode": "markdown",
-    }
+    # Then, hand over to the sink, or send right away if it isn't running
+    if LogSink.running:
+        LogSink.put(text, priority)
+    else:
+        _send_sync(text)
 
+
+def _message(text: str, markdown: bool) -> dict:
+    body = {"chat_id": Credentials.tg_admin_chat_id, "text": text}
+    if markdown:
+        body["parse_mode"] = "markdown"
+    return body
+
+
+def _send_sync(text: str):
+    """Sends a message with a blocking request, for use outside of the event loop."""
     try:
         response = urequests.get(
-            url=f"https://api.telegram.org/bot{Credentials.tg_bot_token}/sendMessage",
-            json=body,
+            url=f"{_telegram_url}/bot{Credentials.tg_bot_token}/sendMessage",
+            json=_message(text, markdown=True),
         )
 
         if response.status_code != 200:
@@ -64,3 +196,125 @@ def _log(text: str):
     except Exception as e:
         # If sending fails, just print the error to serial port
         print(f"Error while sending log message to telegram: {e}")
+
+
+class LogSink:
+    """Ships queued log lines to Telegram without blocking the event loop.
+
+    Lines logged during a flush interval are merged into one message. The queue is
+    bounded, and while Telegram can't be reached lines only go to the serial port.
+    """
+
+    flush_interval_s = 2
+    max_backoff_s = 60
+    send_timeout_s = 20
+    max_message_chars = 4096  # Telegram's limit
+    max_queued_chars = 8 * 1024
+
+    running = False
+
+    _session = None  # Created on the first send
+    _queue: list = []  # (priority, text)
+    _queued_chars = 0
+    _dropped = 0
+
+    @classmethod
+    def put(cls, text: str, priority: int = LOW):
+        cls._queue.append((priority, text))
+        cls._queued_chars += len(text)
+        cls._shrink()
+
+    @classmethod
+    def _shrink(cls):
+        # Drop the oldest low priority line first, the oldest line of any priority if none
+        while cls._queued_chars > cls.max_queued_chars and cls._queue:
+            index = 0
+            for i, (priority, _) in enumerate(cls._queue):
+                if priority == LOW:
+                    index = i
+                    break
+            cls._queued_chars -= len(cls._queue.pop(index)[1])
+            cls._dropped += 1
+
+    @classmethod
+    def _take_batch(cls) -> tuple[int, str]:
+        """Removes lines for one message from the queue, returns them merged."""
+        lines = []
+        size = 0
+        batch_priority = LOW
+        if cls._dropped:
+            lines.append(f"({cls._dropped} log lines dropped)")
+            size = len(lines[0]) + 1
+            cls._dropped = 0
+
+        while cls._queue:
+            priority, text = cls._queue[0]
+            room = cls.max_message_chars - size
+            if len(text) > room:
+                if lines:
+                    break
+                # A single line over the limit, send it in parts
+                cls._queue[0] = (priority, text[room:])
+                text = text[:room]
+            else:
+                cls._queue.pop(0)
+            cls._queued_chars -= len(text)
+            batch_priority = max(batch_priority, priority)
+            lines.append(text)
+            size += len(text) + 1
+
+        return batch_priority, "\n".join(lines)
+
+    @classmethod
+    async def _send(cls, text: str):
+        import aiohttp
+        from concurrency import tls_limiter
+
+        if cls._session is None:
+            cls._session = aiohttp.ClientSession(
+                f"{_telegram_url}/bot{Credentials.tg_bot_token}"
+            )
+        async with tls_limiter:
+            for markdown in (True, False):
+                async with cls._session.post(
+                    "/sendMessage", json=_message(text, markdown)
+                ) as response:
+                    status = response.status
+                    if status == 200:
+                        return
+                    # Merged lines may form broken markdown, then send as plain text
+                    if status != 400 or not markdown:
+                        raise ValueError(f"Failed to send log message: {status}")
+
+    @classmethod
+    async def run(cls):
+        cls.running = True
+        delay = cls.flush_interval_s
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                ErrorFilter.summarize()
+
+                while cls._queue or cls._dropped:
+                    priority, text = cls._take_batch()
+                    try:
+                        await asyncio.wait_for(cls._send(text), cls.send_timeout_s)
+                    except Exception as e:
+                        # Offline, keep the lines and retry later with a backoff
+                        print(f"Error while sending log message to telegram: {e}")
+                        cls._queue.insert(0, (priority, text))
+                        cls._queued_chars += len(text)
+                        cls._shrink()
+                        delay = min(delay * 2, cls.max_backoff_s)
+                        break
+                else:
+                    delay = cls.flush_interval_s
+        finally:
+            cls.running = False
+
+    @classmethod
+    def drain(cls):
+        """Sends the remaining lines with blocking requests, once the event loop is gone."""
+        cls.running = False
+        while cls._queue or cls._dropped:
+            _send_sync(cls._take_batch()[1])
@@ -1,13 +1,12 @@
 import asyncio
-from ecoflow import delta2
-from tuya import tuya_switch
+from devices import DevicePair
+from ecoflow import Delta2Params
 from logger import getLogger
 
 
-log = getLogger("LOGIC")
-
-
 class Logic:
+    """Cutoff state machine for a single (Delta2, relay) pair."""
+
     startup_delay = 10
     device_offline_delay = 60
     start_charging_delay = 60
@@ -17,80 +16,93 @@ class Logic:
     charge_check_add_delay = 10
     full_charge_delay = 10
 
-    @classmethod
-    async def run(cls):
-        log(f"Sleeping for {cls.startup_delay}s before executing logic...")
-        await asyncio.sleep(cls.startup_delay)
+    def __init__(self, pair: DevicePair):
+        self._delta2 = pair.delta2
+        self._switch = pair.switch
+        self._log = getLogger(f"LOGIC {pair.name}")
 
-        await cls.ensure_online()
-        await cls.ensure_charging()
-        await cls.ensure_ac_off()
-        await cls.ensure_battery_full()
+    async def run(self):
+        log = self._log
+        log("Sleeping for %ds before executing logic...", self.startup_delay)
+        await asyncio.sleep(self.startup_delay)
+
+        await self.ensure_online()
+        await self.ensure_charging()
+        await self.ensure_ac_off()
+        await self.ensure_battery_full()
 
         log("All done! You can turn the relay off now.")
         # log("Turning the relay off... Goodbye!)")
-        # await tuya_switch.set_switch(False)
+        # await self._switch.set_switch(False)
 
-    @classmethod
-    async def ensure_online(cls):
+    async def ensure_online(self):
+        log = self._log
         while True:
-            log("Checking Delta2 online status...")
-            if await delta2.is_online():
+            if __debug__:
+                log.debug("Checking Delta2 online status...")
+            if await self._delta2.is_online():
                 break
-            log(f"Delta2 is offline! Sleeping for {cls.device_offline_delay}s...")
-            await asyncio.sleep(cls.device_offline_delay)
+            log("Delta2 is offline! Sleeping for %ds...", self.device_offline_delay)
+            await asyncio.sleep(self.device_offline_delay)
         log("Delta2 is online")
 
-    @classmethod
-    async def ensure_charging(cls):
+    async def ensure_charging(self):
+        log = self._log
         while True:
-            log("Requesting charging status...")
-            if await delta2.charging_line_plugged():
+            if __debug__:
+                log.debug("Requesting charging status...")
+            if await self._delta2.charging_line_plugged():
                 break
             log(
-                f"Delta2 is not charging! Sleeping for {cls.start_charging_delay}s secs..."
+                "Delta2 is not charging! Sleeping for %ds secs...",
+                self.start_charging_delay,
             )
-            await asyncio.sleep(cls.start_charging_delay)
+            await asyncio.sleep(self.start_charging_delay)
         log("Charging line is plugged")
 
-    @classmethod
-    async def ensure_ac_off(cls):
+    async def ensure_ac_off(self):
+        log = self._log
         while True:
-            log("Requesting AC status...")
-            if not await delta2.get_ac_enabled():
+            if __debug__:
+                log.debug("Requesting AC status...")
+            if not await self._delta2.get_ac_enabled():
                 break
-            log(f"AC is on. Sleeping for {cls.ac_auto_off_delay}s before disabling...")
-            await asyncio.sleep(cls.ac_auto_off_delay)
+            log(
+                "AC is on. Sleeping for %ds before disabling...", self.ac_auto_off_delay
+            )
+            await asyncio.sleep(self.ac_auto_off_delay)
             log("Disabling AC...")
-            await delta2.set_ac_enabled(False)
+            await self._delta2.set_ac_enabled(False)
             # We might lose Wi-Fi here ;)
         log("AC is off")
 
-    @classmethod
-    async def ensure_battery_full(cls):
+    async def ensure_battery_full(self):
+        log = self._log
         while True:
-            log("Requesting battery status...")
-            values = await delta2.battery_status()
-            if not values["is_charging"]:
+            if __debug__:
+                log.debug("Requesting battery status...")
+            telemetry = await self._delta2.telemetry(Delta2Params.CHARGE_PROGRESS)
+            if not telemetry.is_charging:
                 break
 
-            remaining_time = values["remaining_time_minutes"] * 60
+            remaining_time = telemetry.remaining_time_minutes * 60
             remaining_chg_time = max(0, remaining_time)
             sleep_time = min(
-                remaining_chg_time + cls.charge_check_add_delay,
-                cls.charge_check_max_delay,
+                remaining_chg_time + self.charge_check_add_delay,
+                self.charge_check_max_delay,
             )
 
             log(
-                f"Battery is {values['soc']}%, "
-                f"{values['remaining_time_minutes']}m until full, "
-                f"rechecking in {sleep_time}s...",
+                "Battery is %d%%, %dm until full, rechecking in %ds...",
+                telemetry.soc,
+                telemetry.remaining_time_minutes,
+                sleep_time,
             )
 
             await asyncio.sleep(sleep_time)
 
         log(
-            f"Battery is fully charged, "
-            f"waiting for {cls.full_charge_delay}s to settle...",
+            "Battery is fully charged, waiting for %ds to settle...",
+            self.full_charge_delay,
         )
-        await asyncio.sleep(cls.full_charge_delay)
+        await asyncio.sleep(self.full_charge_delay)
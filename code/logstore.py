@@ -0,0 +1,163 @@
+"""Append-only log history on flash, kept across reboots.
+
+Lines are buffered in RAM and appended in batches to numbered segment files in `logs/`:
+
+    logs/00000041.log, logs/00000042.log, ...
+
+Once the newest segment is full a new file is started and the oldest one deleted, so
+the store never exceeds `segment_size * segment_count` bytes. Each segment is written
+sequentially and then left alone, which lets the filesystem spread erases evenly.
+
+Segments are plain text, read them over FTP, with `ota.py logs` or the "Logs" bot
+command. Like logger.py, this module must not import other files.
+"""
+
+import asyncio
+import os
+import time
+
+
+class LogStore:
+    directory = "logs"
+    segment_size = 16 * 1024
+    segment_count = 8
+
+    # Fewer, larger writes mean fewer partially programmed flash pages
+    write_interval_s = 60
+    min_write_chars = 1024
+    max_buffered_chars = 4 * 1024
+
+    running = False
+
+    _buffer: list = []
+    _buffered_chars = 0
+    _urgent = False
+    _segment = None  # Number of the segment appended to, found on the first write
+
+    @classmethod
+    def put(cls, text: str, urgent=False):
+        """Buffers a log line, `urgent` ones are written within a second."""
+        now = time.gmtime()
+        line = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d} {}\n".format(
+            now[0], now[1], now[2], now[3], now[4], now[5], text
+        )
+        cls._buffer.append(line)
+        cls._buffered_chars += len(line)
+        cls._urgent = cls._urgent or urgent
+
+        # Without the writer task, e.g. during boot, write right away
+        if not cls.running or cls._buffered_chars > cls.max_buffered_chars:
+            cls.flush()
+
+    @classmethod
+    async def run(cls):
+        cls.running = True
+        last_write = time.ticks_ms()
+        try:
+            while True:
+                await asyncio.sleep(1)
+                elapsed_s = time.ticks_diff(time.ticks_ms(), last_write) // 1000
+                if (
+                    cls._urgent
+                    or cls._buffered_chars >= cls.min_write_chars
+                    or (cls._buffer and elapsed_s >= cls.write_interval_s)
+                ):
+                    cls.flush()
+                    last_write = time.ticks_ms()
+        finally:
+            cls.running = False
+
+    @classmethod
+    def flush(cls):
+        """Appends the buffered lines to the newest segment."""
+        if not cls._buffer:
+            return
+        data = "".join(cls._buffer).encode()
+        cls._buffer = []
+        cls._buffered_chars = 0
+        cls._urgent = False
+
+        try:
+            if cls._segment is None:
+                segments = cls.segments()
+                cls._segment = segments[-1] if segments else 0
+
+            path = cls._path(cls._segment)
+            if cls._size(path) + len(data) > cls.segment_size:
+                cls._rotate()
+                path = cls._path(cls._segment)
+
+            with open(path, "ab") as f:
+                f.write(data)
+
+        except OSError as e:
+            # Flash full or broken, losing history mustn't break logging
+            print(f"Error while writing log to flash: {e}")
+
+    @classmethod
+    def _rotate(cls):
+        cls._segment += 1
+        segments = cls.segments()
+        for segment in segments[: len(segments) - cls.segment_count + 1]:
+            os.remove(cls._path(segment))
+
+    @classmethod
+    def segments(cls) -> list:
+        """Returns the numbers of the stored segments, oldest first."""
+        try:
+            names = os.listdir(cls.directory)
+        except OSError:
+            os.mkdir(cls.directory)
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith(".log"))
+
+    @classmethod
+    def _path(cls, segment: int) -> str:
+        return "{}/{:08d}.log".format(cls.directory, segment)
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.stat(path)[6]
+        except OSError:
+            return 0
+
+    @classmethod
+    def tail(cls, max_chars: int) -> str:
+        """Returns up to `max_chars` of the latest history, starting at a line."""
+        cls.flush()
+        chunks = []
+        remaining = max_chars
+        for segment in reversed(cls.segments()):
+            path = cls._path(segment)
+            size = cls._size(path)
+            with open(path, "rb") as f:
+                f.seek(max(0, size - remaining))
+                data = f.read()
+            chunks.insert(0, data)
+            remaining -= len(data)
+            if remaining <= 0:
+                break
+
+        data = b"".join(chunks)
+        if remaining <= 0:
+            # Skip the cut off line, unless it is all we have (a long traceback)
+            start = data.find(b"\n") + 1
+            if start in (0, len(data)):
+                start = 0
+                # Then only skip the rest of the cut off character
+                while start < len(data) and data[start] & 0xC0 == 0x80:
+                    start += 1
+            data = data[start:]
+
+        try:
+            return data.decode()
+        except UnicodeError:
+            # A line torn by a power cut, drop it and keep the rest
+            lines = []
+            for line in data.split(b"\n"):
+                try:
+                    lines.append(line.decode())
+                except UnicodeError:
+                    pass
+            return "\n".join(lines)
@@ -0,0 +1,151 @@
+"""Minimal asynchronous MQTT 3.1.1 client (subscribe-only) on top of asyncio streams.
+
+Only what is needed to receive pushed telemetry is implemented:
+CONNECT with username/password, SUBSCRIBE, incoming PUBLISH (QoS 0/1) and keepalive pings.
+"""
+
+import asyncio
+import struct
+
+
+class MqttClient:
+    class MqttException(Exception):
+        pass
+
+    CONNECT = 0x10
+    CONNACK = 0x20
+    PUBLISH = 0x30
+    PUBACK = 0x40
+    SUBSCRIBE = 0x82
+    SUBACK = 0x90
+    PINGREQ = 0xC0
+    PINGRESP = 0xD0
+    DISCONNECT = 0xE0
+
+    def __init__(self, client_id: str, user: str, password: str, keepalive_s: int = 60):
+        self._client_id = client_id
+        self._user = user
+        self._password = password
+        self.keepalive_s = keepalive_s
+        self._reader = None
+        self._writer = None
+        self._packet_id = 0
+        self._ping_task = None
+
+    @staticmethod
+    def _encode_str(value: str) -> bytes:
+        data = value.encode()
+        return struct.pack("!H", len(data)) + data
+
+    @staticmethod
+    def _encode_length(length: int) -> bytes:
+        # Variable length encoding: 7 bits per byte, high bit means "more bytes follow"
+        encoded = bytearray()
+        while True:
+            byte = length & 0x7F
+            length >>= 7
+            if length:
+                encoded.append(byte | 0x80)
+            else:
+                encoded.append(byte)
+                return bytes(encoded)
+
+    async def _send_packet(self, header: int, body: bytes = b""):
+        self._writer.write(bytes((header,)) + self._encode_length(len(body)) + body)
+        await self._writer.drain()
+
+    async def _read_packet(self) -> tuple[int, bytes]:
+        header = (await self._reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self._reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await self._reader.readexactly(length) if length else b""
+        return header, body
+
+    def _next_packet_id(self) -> int:
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        return self._packet_id
+
+    async def connect(self, host: str, port: int, ssl=True):
+        self._reader, self._writer = await asyncio.open_connection(host, port, ssl=ssl)
+
+        body = (
+            self._encode_str("MQTT")
+            + bytes((4, 0xC2))  # Protocol level 3.1.1, flags: user, password, clean session
+            + struct.pack("!H", self.keepalive_s)
+            + self._encode_str(self._client_id)
+            + self._encode_str(self._user)
+            + self._encode_str(self._password)
+        )
+        await self._send_packet(self.CONNECT, body)
+
+        header, body = await self._read_packet()
+        if header != self.CONNACK or len(body) != 2 or body[1] != 0:
+            raise self.MqttException(f"Connection refused: {header:#x} {body}")
+
+        self._ping_task = asyncio.create_task(self._keep_alive())
+
+    async def subscribe(self, topic: str, qos: int = 1):
+        body = (
+            struct.pack("!H", self._next_packet_id())
+            + self._encode_str(topic)
+            + bytes((qos,))
+        )
+        await self._send_packet(self.SUBSCRIBE, body)
+        # SUBACK is checked in receive(), since a PUBLISH may arrive before it
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.keepalive_s / 2)
+            try:
+                await self._send_packet(self.PINGREQ)
+            except OSError:
+                return  # receive() will time out waiting for PINGRESP
+
+    async def receive(self) -> tuple[str, bytes]:
+        """Waits for the next PUBLISH and returns its topic and payload.
+
+        Raises asyncio.TimeoutError if nothing (not even a PINGRESP) arrives
+        for 1.5 keepalive periods, which is how a half-open connection is detected.
+        """
+        while True:
+            header, body = await asyncio.wait_for(
+                self._read_packet(), self.keepalive_s * 3 / 2
+            )
+            packet_type = header & 0xF0
+
+            if packet_type == self.PUBLISH:
+                qos = (header >> 1) & 0x03
+                (topic_len,) = struct.unpack_from("!H", body, 0)
+                topic = body[2 : 2 + topic_len].decode()
+                offset = 2 + topic_len
+                if qos:
+                    packet_id = body[offset : offset + 2]
+                    offset += 2
+                    await self._send_packet(self.PUBACK, packet_id)
+                return topic, body[offset:]
+
+            elif packet_type == self.SUBACK:
+                if body[-1] == 0x80:
+                    raise self.MqttException("Subscription refused")
+
+            elif packet_type != self.PINGRESP:
+                raise self.MqttException(f"Unexpected packet {header:#x}")
+
+    async def close(self):
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+        if self._writer is not None:
+            try:
+                await self._send_packet(self.DISCONNECT)
+                self._writer.close()
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._reader = self._writer = None
@@ -0,0 +1,31 @@
+import binascii
+import hashlib
+
+
+class HmacSha256Signer:
+    """HMAC-SHA256 signer that prepares the key material once per API client.
+
+    `hmac.new` pads the key and builds the inner/outer pads byte by byte on every call,
+    and built-in hashes can't be `copy()`-ed to reuse a keyed state. So we keep the
+    padded pads instead and only run two SHA256 passes per message.
+    """
+
+    block_size = 64
+
+    def __init__(self, key: bytes):
+        if len(key) > self.block_size:
+            key = hashlib.sha256(key).digest()
+        key = key + bytes(self.block_size - len(key))
+
+        self._inner_pad = bytes(b ^ 0x36 for b in key)
+        self._outer_pad = bytes(b ^ 0x5C for b in key)
+
+    def digest(self, msg: bytes) -> bytes:
+        inner = hashlib.sha256(self._inner_pad)
+        inner.update(msg)
+        outer = hashlib.sha256(self._outer_pad)
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def hexdigest(self, msg: bytes) -> str:
+        return binascii.hexlify(self.digest(msg)).decode()
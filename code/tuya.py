@@ -1,51 +1,61 @@
-import hmac
+import asyncio
 import binascii
 import hashlib
 import json
+import time
 
 import aiohttp
 
 from clock import Clock
+from concurrency import gather_limited, tls_limiter
 from credentials import Credentials
+from endpoints import TUYA_URL
+from logger import getLogger
+from signer import HmacSha256Signer
+from tuya_local import TuyaLocalDevice
+
+log = getLogger("TUYA")
 
 
 class TuyaApi:
-    _session = aiohttp.ClientSession("https://openapi.tuyaeu.com")
+    _session = aiohttp.ClientSession(TUYA_URL)
+
+    # Tokens are refreshed this long before they expire
+    token_refresh_margin_s = 300
+
+    # "token invalid" and "token expired" error codes
+    _TOKEN_ERROR_CODES = (1010, 1011)
 
     class TuyaApiException(Exception):
         pass
 
+    class TokenInvalid(TuyaApiException):
+        pass
+
     def __init__(self, access_id: str, access_key: str):
         self._access_id = access_id
-        self._access_key = access_key
+        self._signer = HmacSha256Signer(access_key.encode("utf-8"))
         self._access_token = None
+        self._refresh_token = None
+        self._token_expires_at = 0  # ticks_ms
+        self._token_lock = asyncio.Lock()
+        self._token_refresh_task = None
 
     @classmethod
     # --- CRYPTO HELPERS ---
-    def _sha256_hex(cls, data):
-        return binascii.hexlify(hashlib.sha256(data.encode("utf-8")).digest()).decode(
-            "utf-8"
-        )
+    def _sha256_hex(cls, data: bytes):
+        return binascii.hexlify(hashlib.sha256(data).digest()).decode("utf-8")
 
-    @classmethod
-    def _hmac_sha256_hex(cls, key, msg):
-        return (
-            binascii.hexlify(
-                hmac.new(
-                    key.encode("utf-8"), msg.encode("utf-8"), hashlib.sha256
-                ).digest()
-            )
-            .decode("utf-8")
-            .upper()
-        )
+    def _hmac_sha256_hex(self, msg):
+        return self._signer.hexdigest(msg.encode("utf-8")).upper()
 
     # --- SIGNATURE CALCULATION (The Hard Part) ---
-    def _calc_sign(self, method, url, body_str, token=""):
+    def _calc_sign(self, method, url, body: bytes, token=""):
         t = Clock.get_unix_time_ms()
 
         # 1. Calculate Content-SHA256
         # If body is empty, hash an empty string
-        content_sha256 = self._sha256_hex(body_str)
+        content_sha256 = self._sha256_hex(body)
 
         # 2. Build "String to Sign"
         # Format: METHOD + \n + Content-SHA256 + \n + Headers + \n + URL
@@ -55,20 +65,18 @@ class TuyaApi:
         # 3. Sign it
         # Format: AccessID + Token + t + StringToSign
         str_to_encrypt = f"{self._access_id}{token}{t}{string_to_sign}"
-        sign = self._hmac_sha256_hex(self._access_key, str_to_encrypt)
+        sign = self._hmac_sha256_hex(str_to_encrypt)
 
         return sign, t
 
     async def _send_request_with_token(
         self, method: str, url: str, json_body: dict | None = None, token: str = ""
     ):
-        if json_body is None:
-            body_str = ""
-        else:
-            body_str = json.dumps(json_body)
+        # Serialize once and sign the exact bytes we send
+        body = b"" if json_body is None else json.dumps(json_body).encode()
 
         # Calculate Signature
-        sign, t = self._calc_sign(method, url, body_str, token)
+        sign, t = self._calc_sign(method, url, body, token)
 
         headers = {
             "t": t,
@@ -79,27 +87,104 @@ class TuyaApi:
             "Content-Type": "application/json",
         }
 
-        async with self._session.request(
-            method.upper(), url, headers=headers, json=json_body
-        ) as response:
-            result_json = await response.json()
+        async with tls_limiter:
+            async with self._session.request(
+                method.upper(), url, headers=headers, data=body or None
+            ) as response:
+                result_json = await response.json()
 
         if not result_json.get("success"):
+            if result_json.get("code") in self._TOKEN_ERROR_CODES:
+                raise self.TokenInvalid(result_json)
             raise self.TuyaApiException(result_json)
         return result_json
 
-    async def _send_request(self, method: str, url: str, body: dict | None = None):
-        if self._access_token is None:
-            # Get token
-            token_response = await self._send_request_with_token(
+    # --- ACCESS TOKEN ---
+    def _store_token(self, result: dict):
+        self._access_token = result["access_token"]
+        self._refresh_token = result["refresh_token"]
+        expire_ms = result["expire_time"] * 1000
+        self._token_expires_at = time.ticks_add(time.ticks_ms(), expire_ms)
+
+        # Refresh in the background, so requests never wait for a token
+        if self._token_refresh_task is not None:
+            self._token_refresh_task.cancel()
+        refresh_in_s = max(0, result["expire_time"] - self.token_refresh_margin_s)
+        self._token_refresh_task = asyncio.create_task(
+            self._refresh_later(refresh_in_s)
+        )
+
+    async def _refresh_later(self, delay_s: float):
+        await asyncio.sleep(delay_s)
+        self._token_refresh_task = None
+        try:
+            await self._fetch_token(self._access_token)
+        except Exception as e:
+            # The next request fetches a new token if this one expires meanwhile
+            log("Token refresh failed: %s", e)
+
+    async def _fetch_token(self, stale_token: str | None):
+        """Replaces `stale_token`, unless another task did so while we waited."""
+        async with self._token_lock:
+            if self._token_valid() and self._access_token != stale_token:
+                return
+
+            if self._refresh_token is not None:
+                try:
+                    response = await self._send_request_with_token(
+                        "GET", f"/v1.0/token/{self._refresh_token}"
+                    )
+                    self._store_token(response["result"])
+                    return
+                except self.TuyaApiException:
+                    self._refresh_token = None  # Fall back to a new token
+
+            response = await self._send_request_with_token(
                 "GET", "/v1.0/token?grant_type=1"
             )
-            self._access_token = token_response["result"]["access_token"]
+            self._store_token(response["result"])
 
-        response = await self._send_request_with_token(
-            method, url, body, self._access_token
+    def _token_valid(self) -> bool:
+        return (
+            self._access_token is not None
+            and time.ticks_diff(self._token_expires_at, time.ticks_ms()) > 0
         )
-        return response
+
+    async def _get_token(self) -> str:
+        if not self._token_valid():
+            await self._fetch_token(self._access_token)
+        return self._access_token
+
+    async def _send_request(self, method: str, url: str, body: dict | None = None):
+        token = await self._get_token()
+        try:
+            return await self._send_request_with_token(method, url, body, token)
+        except self.TokenInvalid:
+            # Revoked or expired early, retry once with a new token
+            await self._fetch_token(token)
+            return await self._send_request_with_token(
+                method, url, body, await self._get_token()
+            )
+
+    # The batch status endpoint accepts at most this many device IDs per call
+    status_batch_size = 20
+
+    async def get_statuses(self, device_ids: list[str]) -> dict:
+        """Reads the status of several devices in one call per `status_batch_size`.
+
+        Returns `{device_id: {code: value}}`, omitting devices missing from the answer.
+        """
+        statuses = {}
+        for i in range(0, len(device_ids), self.status_batch_size):
+            batch = device_ids[i : i + self.status_batch_size]
+            response = await self._send_request(
+                "GET", f"/v1.0/iot-03/devices/status?device_ids={','.join(batch)}"
+            )
+            for device in response["result"]:
+                statuses[device["id"]] = {
+                    item["code"]: item["value"] for item in device["status"]
+                }
+        return statuses
 
 
 class TuyaDeviceApi:
@@ -107,6 +192,10 @@ class TuyaDeviceApi:
         self._api = api
         self._device_id = device_id
 
+    @property
+    def device_id(self) -> str:
+        return self._device_id
+
     async def send_commands(self, commands: list[dict]):
         response = await self._api._send_request(
             "POST",
@@ -117,10 +206,54 @@ class TuyaDeviceApi:
 
 
 class TuyaSwitch(TuyaDeviceApi):
+    # Data point of the "switch" code on Tuya plugs
+    switch_dp = "1"
+
+    def __init__(
+        self, api: TuyaApi, device_id: str, local: TuyaLocalDevice | None = None
+    ):
+        super().__init__(api, device_id)
+        self._local = local
+
     async def set_switch(self, switch_on: bool):
+        # Switch over LAN when possible: no token, no cloud relay, works offline
+        if self._local is not None:
+            try:
+                await self._local.set_dps({self.switch_dp: switch_on})
+                return {"success": True, "result": True}
+            except TuyaLocalDevice.CONNECTION_ERRORS as e:
+                log("LAN control of %s failed, using the cloud: %r", self._device_id, e)
+
         response = await self.send_commands([{"code": "switch", "value": switch_on}])
         return response
 
+    @classmethod
+    async def set_switches(
+        cls, switches: list, switch_on: bool, max_in_flight: int = 2
+    ) -> dict:
+        """Switches several relays concurrently.
+
+        Cloud fallbacks share `TuyaApi._session`, each request on its own connection.
+        Returns `{device_id: response}`, with the exception as the response on failure.
+        """
+        return await gather_limited(
+            max_in_flight,
+            {switch.device_id: switch.set_switch(switch_on) for switch in switches},
+        )
+
+    @classmethod
+    async def get_switches(cls, switches: list) -> dict:
+        """Reads the state of several relays in one cloud call: `{device_id: bool}`."""
+        if not switches:
+            return {}
+        statuses = await switches[0]._api.get_statuses(
+            [switch.device_id for switch in switches]
+        )
+        return {
+            device_id: status["switch"]
+            for device_id, status in statuses.items()
+            if "switch" in status
+        }
+
 
 api = TuyaApi(Credentials.tuya_access_id, Credentials.tuya_access_key)
-tuya_switch = TuyaSwitch(api, Credentials.tuya_device_id)
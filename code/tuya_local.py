@@ -0,0 +1,249 @@
+"""Local network control of Tuya devices, protocol versions 3.3 and 3.4.
+
+Frames are exchanged with the device over TCP port 6668:
+
+    55AA prefix | seq | cmd | length | payload | CRC32 (3.3) or HMAC-SHA256 (3.4) | AA55
+
+Payloads are AES-128-ECB encrypted with the device's local key (3.3), or with a session
+key negotiated from it when connecting (3.4). The local key can be read from the Tuya
+IoT platform, e.g. with `tinytuya wizard`.
+"""
+
+import asyncio
+import binascii
+import json
+import os
+import struct
+import time
+
+import cryptolib
+
+from signer import HmacSha256Signer
+
+
+class TuyaLocalDevice:
+    port = 6668
+    heartbeat_interval_s = 10
+    response_timeout_s = 3
+
+    class TuyaLocalException(Exception):
+        pass
+
+    CONNECTION_ERRORS = (OSError, EOFError, asyncio.TimeoutError, TuyaLocalException)
+
+    _PREFIX = 0x000055AA
+    _SUFFIX = 0x0000AA55
+    _AES_ECB = 1
+
+    SESS_KEY_NEG_START = 0x03
+    SESS_KEY_NEG_RESP = 0x04
+    SESS_KEY_NEG_FINISH = 0x05
+    CONTROL = 0x07
+    STATUS = 0x08
+    HEART_BEAT = 0x09
+    DP_QUERY = 0x0A
+    CONTROL_NEW = 0x0D
+    DP_QUERY_NEW = 0x10
+
+    # Commands sent without the "3.x" + 12 zero bytes version header
+    _NO_VERSION_HEADER = (
+        SESS_KEY_NEG_START,
+        SESS_KEY_NEG_RESP,
+        SESS_KEY_NEG_FINISH,
+        HEART_BEAT,
+        DP_QUERY,
+        DP_QUERY_NEW,
+    )
+
+    def __init__(self, device_id: str, local_key: str, host: str, version="3.3"):
+        self._device_id = device_id
+        self._local_key = local_key.encode()
+        self._host = host
+        self._v34 = str(version) == "3.4"
+        self._version_header = str(version).encode() + bytes(12)
+
+        self._key = self._local_key  # Session key on 3.4
+        self._signer = HmacSha256Signer(self._key)
+        self._reader = None
+        self._writer = None
+        self._seq = 0
+        self._lock = asyncio.Lock()
+
+    # --- FRAMING ---
+    def _set_key(self, key: bytes):
+        self._key = key
+        self._signer = HmacSha256Signer(key)
+
+    def _encrypt(self, data: bytes) -> bytes:
+        padding = 16 - len(data) % 16
+        data = data + bytes((padding,)) * padding
+        return cryptolib.aes(self._key, self._AES_ECB).encrypt(data)
+
+    def _decrypt(self, data: bytes) -> bytes:
+        data = cryptolib.aes(self._key, self._AES_ECB).decrypt(data)
+        return data[: -data[-1]]
+
+    def _encode_payload(self, cmd: int, data: bytes) -> bytes:
+        header = b"" if cmd in self._NO_VERSION_HEADER else self._version_header
+        if self._v34:
+            return self._encrypt(header + data)
+        return header + self._encrypt(data)
+
+    def _decode_payload(self, payload: bytes):
+        if not payload:
+            return None
+        if not self._v34 and payload.startswith(self._version_header[:3]):
+            payload = payload[len(self._version_header) :]
+        data = self._decrypt(payload)
+        if data.startswith(self._version_header[:3]):
+            data = data[len(self._version_header) :]
+        return json.loads(data) if data else None
+
+    def _check(self, data: bytes) -> bytes:
+        if self._v34:
+            return self._signer.digest(data)
+        return struct.pack(">I", binascii.crc32(data) & 0xFFFFFFFF)
+
+    async def _send(self, cmd: int, payload: bytes):
+        self._seq += 1
+        check_len = 32 if self._v34 else 4
+        header = struct.pack(
+            ">4I", self._PREFIX, self._seq, cmd, len(payload) + check_len + 4
+        )
+        frame = header + payload
+        self._writer.write(frame + self._check(frame) + struct.pack(">I", self._SUFFIX))
+        await self._writer.drain()
+
+    async def _read_frame(self) -> tuple[int, int, bytes]:
+        """Reads a frame and returns its command, return code and payload."""
+        header = await self._reader.readexactly(16)
+        prefix, _, cmd, length = struct.unpack(">4I", header)
+        if prefix != self._PREFIX:
+            raise self.TuyaLocalException(f"Bad frame prefix {prefix:#x}")
+        body = await self._reader.readexactly(length)
+
+        check_len = 32 if self._v34 else 4
+        payload = body[: -check_len - 4]
+        if body[-check_len - 4 : -4] != self._check(header + payload):
+            raise self.TuyaLocalException("Frame integrity check failed")
+
+        # Frames from the device usually start with a return code
+        retcode = 0
+        if len(payload) >= 4 and not payload[0] | payload[1] | payload[2]:
+            retcode = payload[3]
+            payload = payload[4:]
+        return cmd, retcode, payload
+
+    async def _exchange(self, cmd: int, data, response_cmd: int) -> bytes:
+        """Sends a command and returns its answer's payload, skipping status pushes."""
+        payload = data if isinstance(data, bytes) else json.dumps(data).encode()
+        await self._send(cmd, self._encode_payload(cmd, payload))
+        while True:
+            frame_cmd, retcode, payload = await asyncio.wait_for(
+                self._read_frame(), self.response_timeout_s
+            )
+            if frame_cmd == response_cmd:
+                if retcode:
+                    raise self.TuyaLocalException(f"Command {cmd:#x} failed: {retcode}")
+                return payload
+
+    # --- CONNECTION ---
+    async def _negotiate_session_key(self):
+        signer = self._signer  # Keyed with the local key
+        local_nonce = os.urandom(16)
+        payload = await self._exchange(
+            self.SESS_KEY_NEG_START, local_nonce, self.SESS_KEY_NEG_RESP
+        )
+
+        data = self._decrypt(payload)
+        remote_nonce = data[:16]
+        if data[16:48] != signer.digest(local_nonce):
+            raise self.TuyaLocalException(
+                "Session key negotiation failed, wrong local key?"
+            )
+        await self._send(
+            self.SESS_KEY_NEG_FINISH,
+            self._encode_payload(self.SESS_KEY_NEG_FINISH, signer.digest(remote_nonce)),
+        )
+
+        nonces_xor = bytes(a ^ b for a, b in zip(local_nonce, remote_nonce))
+        cipher = cryptolib.aes(self._local_key, self._AES_ECB)
+        self._set_key(cipher.encrypt(nonces_xor))
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self.port), self.response_timeout_s
+        )
+        self._seq = 0
+        self._set_key(self._local_key)
+        if self._v34:
+            await self._negotiate_session_key()
+        asyncio.create_task(self._heartbeat(self._writer))
+
+    def _close(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+            self._reader = self._writer = None
+
+    async def _heartbeat(self, writer):
+        # Devices drop connections that stay silent for ~30s
+        while True:
+            await asyncio.sleep(self.heartbeat_interval_s)
+            async with self._lock:
+                if self._writer is not writer:
+                    return  # Closed or replaced by a newer connection
+                try:
+                    await self._exchange(self.HEART_BEAT, {}, self.HEART_BEAT)
+                except self.CONNECTION_ERRORS:
+                    self._close()
+                    return
+
+    async def _request(self, cmd: int, data: dict, response_cmd: int) -> bytes:
+        async with self._lock:
+            # The persistent connection may have gone stale, so reconnect once
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._exchange(cmd, data, response_cmd)
+                except self.CONNECTION_ERRORS:
+                    self._close()
+                    if attempt:
+                        raise
+
+    # --- DATA POINTS ---
+    async def set_dps(self, dps: dict):
+        # Devices don't check "t", so the epoch doesn't matter
+        if self._v34:
+            cmd = self.CONTROL_NEW
+            data = {"protocol": 5, "t": int(time.time()), "data": {"dps": dps}}
+        else:
+            cmd = self.CONTROL
+            data = {
+                "devId": self._device_id,
+                "uid": self._device_id,
+                "t": str(int(time.time())),
+                "dps": dps,
+            }
+        await self._request(cmd, data, cmd)
+
+    async def get_dps(self) -> dict:
+        if self._v34:
+            cmd, data = self.DP_QUERY_NEW, {}
+        else:
+            cmd = self.DP_QUERY
+            data = {
+                "gwId": self._device_id,
+                "devId": self._device_id,
+                "uid": self._device_id,
+                "t": str(int(time.time())),
+            }
+        payload = await self._request(cmd, data, cmd)
+        return self._decode_payload(payload)["dps"]
+
+    async def close(self):
+        async with self._lock:
+            self._close()
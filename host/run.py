@@ -0,0 +1,145 @@
+"""Runs the unmodified application from `code/` on a development machine.
+
+    python host/run.py [--ntp] [--profile FILE] [--tracemalloc]
+    micropython host/run.py [--ntp]
+
+ESP32-only modules are replaced by the stand-ins from `host/shims/`. Under CPython the
+MicroPython-specific parts of `time`, `sys`, `socket` and `asyncio` streams are
+emulated as well. Set `simulator_url` in `code/credentials.py` to run against
+`simulator.py` instead of the real clouds.
+
+--ntp           queries the real NTP servers instead of using the host clock
+--profile FILE  writes cProfile stats to FILE on exit (CPython only)
+--tracemalloc   prints the top allocation sites on exit (CPython only)
+"""
+
+import sys
+
+# Repository root, `python host/run.py` from the root gives "host/run.py" here
+ROOT = "/".join(__file__.split("/")[:-2]) or "."
+
+IS_CPYTHON = sys.implementation.name != "micropython"
+
+# On CPython code/lib/*.mpy can't be loaded, so import the libraries from their sources
+sys.path[:0] = [f"{ROOT}/host", f"{ROOT}/code", f"{ROOT}/lib_sources"]
+
+
+def install_shims():
+    shims = __import__("shims")
+    names = shims.MODULES + (shims.CPYTHON_MODULES if IS_CPYTHON else ())
+    for name in names:
+        sys.modules[name] = getattr(__import__("shims." + name), name)
+
+
+def use_host_clock():
+    """Answers NTP queries from the host clock, which is NTP-synchronized already."""
+    import time
+    from ntp import Ntp
+
+    def ntp_time(cls, epoch=None):
+        now_us = time.time_ns() // 1000
+        return now_us + cls.epoch_delta(Ntp.EPOCH_1970, epoch) * 1000_000, time.ticks_us()
+
+    Ntp.ntp_time = classmethod(ntp_time)
+
+
+def install_cpython_compat():
+    import asyncio
+    import os
+    import socket
+    import time
+    import traceback
+
+    # Ticks wrap around like on the ESP32, so ticks_diff() misuse shows up here too
+    ticks_period = 1 << 30
+    started_ns = time.monotonic_ns()
+
+    def ticks(divider):
+        return lambda: (time.monotonic_ns() - started_ns) // divider % ticks_period
+
+    def ticks_diff(end, start):
+        half = ticks_period // 2
+        return (end - start + half) % ticks_period - half
+
+    time.ticks_ms = ticks(1000_000)
+    time.ticks_us = ticks(1000)
+    time.ticks_cpu = ticks(1)
+    time.ticks_diff = ticks_diff
+    time.ticks_add = lambda ticks_value, delta: (ticks_value + delta) % ticks_period
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000_000)
+
+    # MicroPython's mktime() and RTC work in UTC
+    os.environ["TZ"] = "UTC"
+    time.tzset()
+
+    sys.print_exception = lambda e, file=sys.stdout: traceback.print_exception(
+        e, file=file
+    )
+
+    socket.socket.readinto = lambda self, buf: self.recv_into(buf)
+
+    async def awrite(self, buf, off=0, sz=-1):
+        # MicroPython streams are bidirectional and callers may keep only the reader,
+        # while CPython closes the socket once its StreamWriter is collected
+        self._reader._writer = self
+        self.write(buf[off:] if sz == -1 else buf[off : off + sz])
+        await self.drain()
+
+    async def aclose(self):
+        transport = getattr(self, "_transport", None)
+        if transport is not None:
+            transport.close()
+
+    asyncio.StreamWriter.awrite = awrite
+    asyncio.StreamWriter.aclose = aclose
+    asyncio.StreamReader.aclose = aclose
+
+
+def run_boot():
+    """Executes `code/main.py` the same way the firmware does on boot."""
+    with open(f"{ROOT}/code/main.py") as f:
+        source = f.read()
+    exec(compile(source, "main.py", "exec"), {"__name__": "__main__"})
+
+
+def main(argv):
+    install_shims()
+    if IS_CPYTHON:
+        install_cpython_compat()
+    if "--ntp" not in argv:
+        use_host_clock()
+    if not IS_CPYTHON:
+        run_boot()
+        return
+
+    profile_path = argv[argv.index("--profile") + 1] if "--profile" in argv else None
+    if "--tracemalloc" in argv:
+        import tracemalloc
+
+        tracemalloc.start(10)
+
+    profiler = None
+    if profile_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        run_boot()
+    except KeyboardInterrupt:
+        print("Interrupted")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"Profile written to {profile_path}")
+        if "--tracemalloc" in argv:
+            snapshot = tracemalloc.take_snapshot()
+            for stat in snapshot.statistics("lineno")[:20]:
+                print(stat)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,6 @@
+"""Stand-ins for the ESP32-only modules `code/` imports, see `host/run.py`."""
+
+MODULES = ("machine", "network", "urequests", "uftpd")
+
+# Built into the MicroPython unix port, missing on CPython
+CPYTHON_MODULES = ("cryptolib",)
@@ -0,0 +1,111 @@
+"""Host stand-in for MicroPython's `cryptolib`: AES-128 in ECB mode, in pure Python.
+
+Slow, but Tuya LAN frames are a few dozen bytes.
+"""
+
+MODE_ECB = 1
+
+
+def _xtime(a: int) -> int:
+    a <<= 1
+    return a ^ 0x11B if a & 0x100 else a
+
+
+def _mul(a: int, b: int) -> int:
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = _xtime(a)
+        b >>= 1
+    return result
+
+
+def _build_sbox():
+    sbox = [0] * 256
+    # Multiplicative inverse followed by the affine transformation
+    for x in range(256):
+        inv = 0
+        if x:
+            inv = next(y for y in range(1, 256) if _mul(x, y) == 1)
+        s = inv
+        for shift in range(1, 5):
+            s ^= ((inv << shift) | (inv >> (8 - shift))) & 0xFF
+        sbox[x] = s ^ 0x63
+    inv_sbox = [0] * 256
+    for x, s in enumerate(sbox):
+        inv_sbox[s] = x
+    return sbox, inv_sbox
+
+
+_SBOX, _INV_SBOX = _build_sbox()
+
+
+class aes:
+    def __init__(self, key: bytes, mode: int, iv=None):
+        if mode != MODE_ECB or len(key) != 16:
+            raise ValueError("Only AES-128 in ECB mode is supported")
+        self._round_keys = self._expand_key(bytes(key))
+
+    @staticmethod
+    def _expand_key(key: bytes) -> list:
+        words = [list(key[i : i + 4]) for i in range(0, 16, 4)]
+        rcon = 1
+        for i in range(4, 44):
+            word = list(words[i - 1])
+            if i % 4 == 0:
+                word = [_SBOX[b] for b in word[1:] + word[:1]]
+                word[0] ^= rcon
+                rcon = _xtime(rcon)
+            words.append([a ^ b for a, b in zip(words[i - 4], word)])
+        return [sum(words[r * 4 : r * 4 + 4], []) for r in range(11)]
+
+    @staticmethod
+    def _shift_rows(state: list, direction: int) -> list:
+        # State is column-major: state[row + 4 * column]
+        return [
+            state[r + 4 * ((c + direction * r) % 4)] for c in range(4) for r in range(4)
+        ]
+
+    @staticmethod
+    def _mix_columns(state: list, matrix: tuple) -> list:
+        out = []
+        for c in range(4):
+            column = state[4 * c : 4 * c + 4]
+            for r in range(4):
+                value = 0
+                for i in range(4):
+                    value ^= _mul(column[i], matrix[(i - r) % 4])
+                out.append(value)
+        return out
+
+    def _encrypt_block(self, block) -> bytes:
+        keys = self._round_keys
+        state = [b ^ k for b, k in zip(block, keys[0])]
+        for rnd in range(1, 11):
+            state = self._shift_rows([_SBOX[b] for b in state], 1)
+            if rnd != 10:
+                state = self._mix_columns(state, (2, 3, 1, 1))
+            state = [b ^ k for b, k in zip(state, keys[rnd])]
+        return bytes(state)
+
+    def _decrypt_block(self, block) -> bytes:
+        keys = self._round_keys
+        state = [b ^ k for b, k in zip(block, keys[10])]
+        for rnd in range(9, -1, -1):
+            state = [_INV_SBOX[b] for b in self._shift_rows(state, -1)]
+            state = [b ^ k for b, k in zip(state, keys[rnd])]
+            if rnd:
+                state = self._mix_columns(state, (14, 11, 13, 9))
+        return bytes(state)
+
+    def _apply(self, data, transform) -> bytes:
+        if len(data) % 16:
+            raise ValueError("Data length must be a multiple of 16")
+        return b"".join(transform(data[i : i + 16]) for i in range(0, len(data), 16))
+
+    def encrypt(self, data) -> bytes:
+        return self._apply(bytes(data), self._encrypt_block)
+
+    def decrypt(self, data) -> bytes:
+        return self._apply(bytes(data), self._decrypt_block)
@@ -0,0 +1,86 @@
+"""Host stand-in for the ESP32 `machine` module: pins keep their state, the RTC follows
+the host clock plus whatever offset was last set."""
+
+import time
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    # Set to True to print every pin change
+    trace = False
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self._value = value or 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        if self.trace and bool(value) != self._value:
+            print(f"[machine] Pin({self.id}) = {int(bool(value))}")
+        self._value = int(bool(value))
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class RTC:
+    # Shared by all instances, as on the device
+    _offset_us = 0
+
+    @staticmethod
+    def _host_us() -> int:
+        return time.time_ns() // 1000
+
+    def datetime(self, dt=None):
+        if dt is None:
+            now_us = self._host_us() + RTC._offset_us
+            t = time.gmtime(now_us // 1000_000)
+            # (year, month, day, weekday, hours, minutes, seconds, subseconds)
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], now_us % 1000_000)
+
+        # mktime() is UTC here, the harness runs with TZ=UTC
+        set_us = time.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0, 0))
+        RTC._offset_us = int(set_us) * 1000_000 + dt[7] - self._host_us()
+
+
+PWRON_RESET = 1
+HARD_RESET = 2
+WDT_RESET = 3
+DEEPSLEEP_RESET = 4
+SOFT_RESET = 5
+
+# Every host run starts like a power-on, set this to test other boot paths
+_reset_cause = PWRON_RESET
+
+
+def reset_cause() -> int:
+    return _reset_cause
+
+
+def unique_id() -> bytes:
+    return b"\x00host\x00"
+
+
+def freq() -> int:
+    return 240_000_000
+
+
+def reset():
+    print("[machine] Hard reset requested, exiting")
+    raise SystemExit(1)
+
+
+def soft_reset():
+    print("[machine] Soft reset requested, exiting")
+    raise SystemExit(0)
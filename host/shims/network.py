@@ -0,0 +1,42 @@
+"""Host stand-in for the ESP32 `network` module: the host is always online,
+so a WLAN interface connects as soon as it is asked to."""
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+
+
+class WLAN:
+    def __init__(self, interface_id=STA_IF):
+        self._active = False
+        self._connected = False
+        self._ifconfig = ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._connected = False
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        self._ifconfig = tuple(config)
+
+    def connect(self, ssid=None, key=None):
+        if not self._active:
+            raise OSError("WiFi Internal Error")
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self) -> bool:
+        return self._connected
+
+    def status(self, param=None):
+        return STAT_GOT_IP if self._connected else STAT_IDLE
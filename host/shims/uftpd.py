@@ -0,0 +1,2 @@
+"""Host stand-in for `uftpd`. The real one starts an FTP server on import through
+ESP32-only socket callbacks; on the host the files are already at hand."""
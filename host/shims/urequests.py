@@ -0,0 +1,56 @@
+"""Host stand-in for `urequests`.
+
+On the MicroPython unix port this is micropython-lib `requests`
+(`micropython -m mip install requests`); on CPython a small urllib-based equivalent.
+"""
+
+import sys
+
+if sys.implementation.name == "micropython":
+    from requests import request, get, post, put  # noqa: F401
+
+else:
+    import json as _json
+    import urllib.error
+    import urllib.request
+
+    class Response:
+        def __init__(self, status_code: int, content: bytes):
+            self.status_code = status_code
+            self.content = content
+
+        @property
+        def text(self) -> str:
+            return self.content.decode()
+
+        def json(self):
+            return _json.loads(self.content)
+
+        def close(self):
+            pass
+
+    def request(method, url, data=None, json=None, headers=None, timeout=None):
+        headers = dict(headers or {})
+        if json is not None:
+            data = _json.dumps(json)
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(data, str):
+            data = data.encode()
+
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                return Response(response.status, response.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read())
+        except urllib.error.URLError as e:
+            raise OSError(str(e.reason))
+
+    def get(url, **kwargs):
+        return request("GET", url, **kwargs)
+
+    def post(url, **kwargs):
+        return request("POST", url, **kwargs)
+
+    def put(url, **kwargs):
+        return request("PUT", url, **kwargs)
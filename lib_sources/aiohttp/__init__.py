@@ -6,7 +6,11 @@ import json as _json
 from .aiohttp_ws import (
     _WSRequestContextManager,
     ClientWebSocketResponse,
+    ReconnectingWebSocket,
     WebSocketClient,
+    WebSocketError,
+    WebSocketMessageStream,
+    WSCloseCode,
     WSMsgType,
 )
 
@@ -86,18 +90,20 @@ class _RequestContextManager:
     def __init__(self, client, request_co):
         self.reqco = request_co
         self.client = client
+        self.resp = None
 
     async def __aenter__(self):
-        return await self.reqco
+        self.resp = await self.reqco
+        return self.resp
 
     async def __aexit__(self, *args):
-        await self.client._reader.aclose()
+        # Close this request's own connection, others may be in flight on the session
+        await self.resp.content.aclose()
         return await asyncio.sleep(0)
 
 
 class ClientSession:
     def __init__(self, base_url="", headers={}, version=HttpVersion10):
-        self._reader = None
         self._base_url = base_url
         self._base_headers = {"Connection": "close", "User-Agent": "compat"}
         self._base_headers.update(**headers)
@@ -116,20 +122,25 @@ class ClientSession:
         while redir_cnt < 2:
             reader = await self.request_raw(method, url, data, json, ssl, params, headers)
             _headers = []
-            sline = await reader.readline()
-            sline = sline.split(None, 2)
-            status = int(sline[1])
-            chunked = False
-            while True:
-                line = await reader.readline()
-                if not line or line == b"\r\n":
-                    break
-                _headers.append(line)
-                if line.startswith(b"Transfer-Encoding:"):
-                    if b"chunked" in line:
-                        chunked = True
-                elif line.startswith(b"Location:"):
-                    url = line.rstrip().split(None, 1)[1].decode()
+            try:
+                sline = await reader.readline()
+                sline = sline.split(None, 2)
+                status = int(sline[1])
+                chunked = False
+                while True:
+                    line = await reader.readline()
+                    if not line or line == b"\r\n":
+                        break
+                    _headers.append(line)
+                    if line.startswith(b"Transfer-Encoding:"):
+                        if b"chunked" in line:
+                            chunked = True
+                    elif line.startswith(b"Location:"):
+                        url = line.rstrip().split(None, 1)[1].decode()
+            except BaseException:
+                # No response object owns the connection yet
+                await reader.aclose()
+                raise
 
             if 301 <= status <= 303:
                 redir_cnt += 1
@@ -153,7 +164,6 @@ class ClientSession:
             }
         except Exception:
             pass
-        self._reader = reader
         return resp
 
     async def request_raw(
@@ -203,28 +213,36 @@ class ClientSession:
         if "Host" not in headers:
             headers.update(Host=host)
         if not data:
-            query = b"%s /%s %s\r\n%s\r\n" % (
-                method,
-                path,
-                version,
-                "\r\n".join(f"{k}: {v}" for k, v in headers.items()) + "\r\n" if headers else "",
-            )
+            query = (
+                "%s /%s %s\r\n%s\r\n"
+                % (
+                    method,
+                    path,
+                    version,
+                    "\r\n".join(f"{k}: {v}" for k, v in headers.items()) + "\r\n" if headers else "",
+                )
+            ).encode()
         else:
             if json:
                 headers.update(**{"Content-Type": "application/json"})
             if isinstance(data, bytes):
-                headers.update(**{"Content-Type": "application/octet-stream"})
+                # Callers may send pre-serialized bodies of other types, e.g. JSON
+                if "Content-Type" not in headers:
+                    headers.update(**{"Content-Type": "application/octet-stream"})
             else:
                 data = data.encode()
 
             headers.update(**{"Content-Length": len(data)})
-            query = b"""%s /%s %s\r\n%s\r\n%s""" % (
-                method,
-                path,
-                version,
-                "\r\n".join(f"{k}: {v}" for k, v in headers.items()) + "\r\n",
-                data,
-            )
+            # Format the head as str and append the body, so this also runs on CPython
+            query = (
+                "%s /%s %s\r\n%s\r\n"
+                % (
+                    method,
+                    path,
+                    version,
+                    "\r\n".join(f"{k}: {v}" for k, v in headers.items()) + "\r\n",
+                )
+            ).encode() + data
         if not is_handshake:
             await writer.awrite(query)
             return reader
@@ -267,14 +285,37 @@ class ClientSession:
     def options(self, url, **kwargs):
         return self.request("OPTIONS", url, **kwargs)
 
-    def ws_connect(self, url, ssl=None):
-        return _WSRequestContextManager(self, self._ws_connect(url, ssl=ssl))
+    def ws_connect(self, url, ssl=None, **kwargs):
+        return _WSRequestContextManager(self, self._ws_connect(url, ssl=ssl, **kwargs))
 
-    async def _ws_connect(self, url, ssl=None):
-        ws_client = WebSocketClient(self._base_headers.copy())
+    async def _ws_connect(
+        self,
+        url,
+        ssl=None,
+        max_msg_size=256 * 1024,
+        heartbeat=None,
+        pong_timeout=None,
+        idle_timeout=None,
+        compress=0,
+        context_takeover=False,
+    ):
+        ws_client = WebSocketClient(
+            self._base_headers.copy(),
+            max_msg_size=max_msg_size,
+            compress=compress,
+            context_takeover=context_takeover,
+        )
         await ws_client.connect(url, ssl=ssl, handshake_request=self.request_raw)
-        self._reader = ws_client.reader
-        return ClientWebSocketResponse(ws_client)
+        return ClientWebSocketResponse(
+            ws_client,
+            heartbeat=heartbeat,
+            pong_timeout=pong_timeout,
+            idle_timeout=idle_timeout,
+        )
+
+    def ws_connect_forever(self, url, ssl=None, **kwargs):
+        """Returns a `ReconnectingWebSocket` that keeps the connection alive across failures."""
+        return ReconnectingWebSocket(self, url, ssl=ssl, **kwargs)
 
 
 __version__ = '0.0.7'
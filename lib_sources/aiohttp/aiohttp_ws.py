@@ -36,6 +36,138 @@ def urlparse(uri):
         return URI(protocol, host, int(port), path)
 
 
+# Bytes masked per step, bounds the temporaries to a few times this size
+_MASK_CHUNK = 256
+
+
+def _apply_mask(buf, mask):
+    """XOR ``buf`` (bytearray or writable memoryview) with the 4-byte ``mask`` in place.
+
+    Each chunk is XORed as a single big integer, so the work happens in C
+    word-at-a-time instead of one Python-level operation per byte, while the
+    extra memory stays the same for any payload size.
+    """
+    length = len(buf)
+    if not length:
+        return
+    view = memoryview(buf)
+    # Chunks start at multiples of 4, so they all use the key from its first byte
+    key = int.from_bytes(bytes(mask) * (_MASK_CHUNK >> 2), "big")
+    for start in range(0, length, _MASK_CHUNK):
+        part = view[start : start + _MASK_CHUNK]
+        size = len(part)
+        part_key = key if size == _MASK_CHUNK else key >> ((_MASK_CHUNK - size) << 3)
+        part[:] = (int.from_bytes(part, "big") ^ part_key).to_bytes(size, "big")
+
+
+class _PerMessageDeflate:
+    """RFC 7692 permessage-deflate codec.
+
+    Uses MicroPython's `deflate` module, falling back to `zlib` on CPython. Each
+    `DeflateIO` is created per message, so on MicroPython both directions run
+    without context takeover and only one window of `2 ** wbits` bytes is alive
+    at a time. Context takeover is supported with `zlib` only.
+    """
+
+    # Messages shorter than this are sent uncompressed
+    min_size = 64
+
+    _SYNC_TAIL = b"\x00\x00\xff\xff"
+    # An empty final fixed-Huffman block, terminates the stream for one-shot inflate
+    _FINAL_BLOCK = b"\x03\x00"
+
+    def __init__(self, server_wbits=15, client_wbits=15, server_takeover=False, client_takeover=False):
+        try:
+            import deflate
+
+            self._deflate = deflate
+        except ImportError:
+            self._deflate = None
+        self.server_wbits = server_wbits
+        self.client_wbits = client_wbits
+        self.server_takeover = server_takeover and self._deflate is None
+        self.client_takeover = client_takeover and self._deflate is None
+        self._compressor = None
+        self._decompressor = None
+
+    @classmethod
+    def offer(cls, wbits, context_takeover):
+        offer = "permessage-deflate; client_max_window_bits={0}; server_max_window_bits={0}".format(wbits)
+        try:
+            import deflate  # noqa: F401
+
+            context_takeover = False
+        except ImportError:
+            pass
+        if not context_takeover:
+            offer += "; client_no_context_takeover; server_no_context_takeover"
+        return offer
+
+    @classmethod
+    def from_response(cls, header, wbits):
+        """Parses the accepted `Sec-WebSocket-Extensions` value, None if deflate was declined."""
+        params = [p.strip() for p in header.split(";")]
+        if params[0] != "permessage-deflate":
+            return None
+        server_wbits = client_wbits = wbits
+        server_takeover = client_takeover = True
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name == "server_no_context_takeover":
+                server_takeover = False
+            elif name == "client_no_context_takeover":
+                client_takeover = False
+            elif name == "server_max_window_bits" and value:
+                server_wbits = int(value.strip('"'))
+            elif name == "client_max_window_bits" and value:
+                client_wbits = int(value.strip('"'))
+        return cls(server_wbits, client_wbits, server_takeover, client_takeover)
+
+    def compress(self, data):
+        """Returns the compressed payload, or None if it should be sent as is."""
+        if len(data) < self.min_size:
+            return None
+        if self._deflate is not None:
+            import io
+
+            buf = io.BytesIO()
+            try:
+                with self._deflate.DeflateIO(buf, self._deflate.RAW, self.client_wbits) as d:
+                    d.write(data)
+            except (OSError, AttributeError, NotImplementedError):
+                return None  # Firmware built without deflate compression
+            # The stream ends with a BFINAL block (RFC 7692 7.2.3.4); appending an
+            # empty stored block and stripping its 0x0000ffff leaves one zero byte
+            return buf.getvalue() + b"\x00"
+
+        import zlib
+
+        compressor = self._compressor or zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -self.client_wbits
+        )
+        if self.client_takeover:
+            self._compressor = compressor
+        return (compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+    def decompress(self, data, limit):
+        """Inflates a message, returning at most `limit + 1` bytes so callers can detect overflow."""
+        if self._deflate is not None:
+            import io
+
+            stream = io.BytesIO(bytes(data) + self._SYNC_TAIL + self._FINAL_BLOCK)
+            with self._deflate.DeflateIO(stream, self._deflate.RAW, self.server_wbits) as d:
+                return d.read(limit + 1)
+
+        import zlib
+
+        if self.server_takeover:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(-self.server_wbits)
+            return self._decompressor.decompress(bytes(data) + self._SYNC_TAIL, limit + 1)
+        decompressor = zlib.decompressobj(-self.server_wbits)
+        return decompressor.decompress(bytes(data) + self._SYNC_TAIL + self._FINAL_BLOCK, limit + 1)
+
+
 class WebSocketMessage:
     def __init__(self, opcode, data):
         self.type = opcode
@@ -48,6 +180,19 @@ class WSMsgType:
     ERROR = 258
 
 
+class WebSocketError(Exception):
+    """Raised when the peer violates a protocol constraint, e.g. an oversized message."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class WSCloseCode:
+    ABNORMAL_CLOSURE = 1006
+    MESSAGE_TOO_BIG = 1009
+
+
 class WebSocketClient:
     CONT = 0
     TEXT = 1
@@ -56,8 +201,15 @@ class WebSocketClient:
     PING = 9
     PONG = 10
 
-    def __init__(self, params):
+    def __init__(self, params, max_msg_size=256 * 1024, compress=0, context_takeover=False):
         self.params = params
+        self.max_msg_size = max_msg_size
+        # Max window bits to offer for permessage-deflate, 0 disables compression
+        self.compress = compress
+        self.context_takeover = context_takeover
+        self._deflate = None
+        # Max seconds to wait for the next frame, None waits forever
+        self.idle_timeout = None
         self.closed = False
         self.reader = None
         self.writer = None
@@ -74,15 +226,16 @@ class WebSocketClient:
     def _parse_frame_header(cls, header):
         byte1, byte2 = struct.unpack("!BB", header)
 
-        # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
+        # Byte 1: FIN(1) RSV1(1) _(1) _(1) OPCODE(4)
         fin = bool(byte1 & 0x80)
+        rsv1 = bool(byte1 & 0x40)
         opcode = byte1 & 0x0F
 
         # Byte 2: MASK(1) LENGTH(7)
         mask = bool(byte2 & (1 << 7))
         length = byte2 & 0x7F
 
-        return fin, opcode, mask, length
+        return fin, rsv1, opcode, mask, length
 
     def _process_websocket_frame(self, opcode, payload):
         if opcode == self.TEXT:
@@ -99,16 +252,18 @@ class WebSocketClient:
         return None, payload
 
     @classmethod
-    def _encode_websocket_frame(cls, opcode, payload):
-        if opcode == cls.TEXT:
+    def _encode_websocket_frame(cls, opcode, payload, compressed=False):
+        if isinstance(payload, str):
             payload = payload.encode()
 
         length = len(payload)
         fin = mask = True
 
         # Frame header
-        # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
+        # Byte 1: FIN(1) RSV1(1) _(1) _(1) OPCODE(4)
         byte1 = 0x80 if fin else 0
+        if compressed:
+            byte1 |= 0x40
         byte1 |= opcode
 
         # Byte 2: MASK(1) LENGTH(7)
@@ -116,24 +271,32 @@ class WebSocketClient:
 
         if length < 126:  # 126 is magic value to use 2-byte length header
             byte2 |= length
-            frame = struct.pack("!BB", byte1, byte2)
+            header_fmt = "!BB"
 
         elif length < (1 << 16):  # Length fits in 2-bytes
             byte2 |= 126  # Magic code
-            frame = struct.pack("!BBH", byte1, byte2, length)
+            header_fmt = "!BBH"
 
         elif length < (1 << 64):
             byte2 |= 127  # Magic code
-            frame = struct.pack("!BBQ", byte1, byte2, length)
+            header_fmt = "!BBQ"
 
         else:
             raise ValueError
 
-        # Mask is 4 bytes
+        # Preallocate the whole frame: header, 4-byte mask, payload
+        header_len = struct.calcsize(header_fmt)
+        frame = bytearray(header_len + 4 + length)
+        if length < 126:
+            struct.pack_into(header_fmt, frame, 0, byte1, byte2)
+        else:
+            struct.pack_into(header_fmt, frame, 0, byte1, byte2, length)
+
         mask_bits = struct.pack("!I", random.getrandbits(32))
-        frame += mask_bits
-        payload = bytes(b ^ mask_bits[i % 4] for i, b in enumerate(payload))
-        return frame + payload
+        frame[header_len : header_len + 4] = mask_bits
+        frame[header_len + 4 :] = payload
+        _apply_mask(memoryview(frame)[header_len + 4 :], mask_bits)
+        return frame
 
     async def handshake(self, uri, ssl, req):
         headers = self.params
@@ -146,6 +309,10 @@ class WebSocketClient:
         headers["Sec-WebSocket-Key"] = str(key, "utf-8")
         headers["Sec-WebSocket-Version"] = "13"
         headers["Origin"] = f"{_http_proto}://{uri.hostname}:{uri.port}"
+        if self.compress:
+            headers["Sec-WebSocket-Extensions"] = _PerMessageDeflate.offer(
+                self.compress, self.context_takeover
+            )
 
         self.reader, self.writer = await req(
             "GET",
@@ -163,73 +330,216 @@ class WebSocketClient:
         while header:
             header = await self.reader.readline()
             header = header[:-2]
-
-    async def receive(self):
+            name, _, value = header.partition(b":")
+            if self.compress and name.lower() == b"sec-websocket-extensions":
+                self._deflate = _PerMessageDeflate.from_response(
+                    value.strip().decode(), self.compress
+                )
+
+    async def _read_data_frame(self):
+        """Reads frames until a data frame (or CLOSE) arrives, answering control frames."""
         while True:
-            opcode, payload, final = await self._read_frame()
-            while not final:
-                # original opcode must be preserved
-                _, morepayload, final = await self._read_frame()
-                payload += morepayload
+            opcode, payload, final, compressed = await self._read_frame()
+            if opcode < self.CLOSE:  # CONT, TEXT or BINARY
+                return opcode, payload, final, compressed
             send_opcode, data = self._process_websocket_frame(opcode, payload)
             if send_opcode:  # pragma: no cover
                 await self.send(data, send_opcode)
             if opcode == self.CLOSE:
                 self.closed = True
-                return opcode, data
-            elif data:  # pragma: no branch
+                return opcode, data, True, False
+
+    async def _read_message(self, opcode, payload, final, compressed):
+        """Completes a message whose first frame has been read, returns (opcode, payload)."""
+        if not final:
+            # Reassemble into one growable buffer, original opcode must be preserved
+            message = bytearray(payload)
+            while not final:
+                cont_opcode, payload, final, _ = await self._read_data_frame()
+                if cont_opcode == self.CLOSE:
+                    return cont_opcode, payload
+                if len(message) + len(payload) > self.max_msg_size:
+                    await self._fail_too_big(len(message) + len(payload))
+                message.extend(payload)
+            payload = message
+        if compressed and self._deflate is not None:
+            payload = self._deflate.decompress(payload, self.max_msg_size)
+            if len(payload) > self.max_msg_size:
+                await self._fail_too_big(len(payload))
+        return opcode, payload
+
+    async def receive(self):
+        while True:
+            opcode, payload = await self._read_message(*await self._read_data_frame())
+            if opcode == self.CLOSE:
+                return opcode, payload
+            _, data = self._process_websocket_frame(opcode, payload)
+            if data:  # pragma: no branch
                 return opcode, data
 
-    async def send(self, data, opcode=None):
-        frame = self._encode_websocket_frame(
-            opcode or (self.TEXT if isinstance(data, str) else self.BINARY), data
+    async def _fail_too_big(self, size):
+        await self.close(WSCloseCode.MESSAGE_TOO_BIG)
+        raise WebSocketError(
+            WSCloseCode.MESSAGE_TOO_BIG,
+            "Message size {} exceeds limit {}".format(size, self.max_msg_size),
         )
+
+    async def send(self, data, opcode=None):
+        opcode = opcode or (self.TEXT if isinstance(data, str) else self.BINARY)
+        compressed = None
+        if self._deflate is not None and opcode < self.CLOSE:
+            compressed = self._deflate.compress(
+                data.encode() if isinstance(data, str) else data
+            )
+        if compressed is not None:
+            frame = self._encode_websocket_frame(opcode, compressed, compressed=True)
+        else:
+            frame = self._encode_websocket_frame(opcode, data)
         self.writer.write(frame)
         await self.writer.drain()
 
-    async def close(self):
+    async def close(self, code=None):
         if not self.closed:  # pragma: no cover
             self.closed = True
-            await self.send(b"", self.CLOSE)
+            await self.send(struct.pack("!H", code) if code else b"", self.CLOSE)
 
     async def _read_frame(self):
-        header = await self.reader.readexactly(2)
+        if self.idle_timeout:
+            try:
+                header = await asyncio.wait_for(
+                    self.reader.readexactly(2), self.idle_timeout
+                )
+            except asyncio.TimeoutError:
+                # Half-open connection: nothing (not even a pong) arrived in time
+                self.closed = True
+                raise WebSocketError(
+                    WSCloseCode.ABNORMAL_CLOSURE,
+                    "No frames received for {}s".format(self.idle_timeout),
+                )
+        else:
+            header = await self.reader.readexactly(2)
         if len(header) != 2:  # pragma: no cover
             # raise OSError(32, "Websocket connection closed")
             opcode = self.CLOSE
             payload = b""
-            return opcode, payload
-        fin, opcode, has_mask, length = self._parse_frame_header(header)
+            return opcode, payload, True, False
+        fin, rsv1, opcode, has_mask, length = self._parse_frame_header(header)
         if length == 126:  # Magic number, length header is 2 bytes
             (length,) = struct.unpack("!H", await self.reader.readexactly(2))
         elif length == 127:  # Magic number, length header is 8 bytes
             (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+        if length > self.max_msg_size:
+            await self._fail_too_big(length)
 
         if has_mask:  # pragma: no cover
             mask = await self.reader.readexactly(4)
         payload = await self.reader.readexactly(length)
         if has_mask:  # pragma: no cover
-            payload = bytes(x ^ mask[i % 4] for i, x in enumerate(payload))
-        return opcode, payload, fin
+            payload = bytearray(payload)
+            _apply_mask(payload, mask)
+            payload = bytes(payload)
+        return opcode, payload, fin, rsv1
 
 
-class ClientWebSocketResponse:
+class WebSocketMessageStream:
+    """Async iterator over the fragments of a single incoming message.
+
+    Yields each frame's payload as raw bytes as soon as it arrives, so large
+    messages never have to be held in memory as a whole. TEXT fragments are not
+    decoded, since a UTF-8 sequence may be split across frames. A compressed
+    message can only be inflated as a whole, so it is yielded as one fragment.
+    """
+
     def __init__(self, wsclient):
         self.ws = wsclient
+        self.type = None
+        self._pending = None
+        self._final = False
+
+    async def _start(self):
+        while True:
+            opcode, payload, final, compressed = await self.ws._read_data_frame()
+            if compressed:
+                opcode, payload = await self.ws._read_message(opcode, payload, final, compressed)
+                final = True
+            if opcode == self.ws.CLOSE:
+                self.type = opcode
+                self._final = True
+                return
+            if payload or not final:  # Skip empty messages like receive() does
+                self.type = opcode
+                self._pending = payload
+                self._final = final
+                return
 
     def __aiter__(self):
         return self
 
     async def __anext__(self):
-        msg = WebSocketMessage(*await self.ws.receive())
+        if self._pending is not None:
+            payload, self._pending = self._pending, None
+            return payload
+        if self._final:
+            raise StopAsyncIteration
+        opcode, payload, self._final, _ = await self.ws._read_data_frame()
+        if opcode == self.ws.CLOSE:
+            self._final = True
+            raise StopAsyncIteration
+        return payload
+
+
+class ClientWebSocketResponse:
+    def __init__(self, wsclient, heartbeat=None, pong_timeout=None, idle_timeout=None):
+        """`heartbeat` is the ping interval in seconds. If no frame (including the pong)
+        arrives within `pong_timeout` after a ping (half the interval by default),
+        receiving fails with `WebSocketError`. Without heartbeat, `idle_timeout` alone
+        bounds the time to wait for the next frame.
+        """
+        self.ws = wsclient
+        self._heartbeat_task = None
+        if heartbeat:
+            if pong_timeout is None:
+                pong_timeout = heartbeat / 2
+            wsclient.idle_timeout = heartbeat + pong_timeout
+            self._heartbeat_task = asyncio.create_task(self._send_heartbeats(heartbeat))
+        elif idle_timeout:
+            wsclient.idle_timeout = idle_timeout
+
+    async def _send_heartbeats(self, interval):
+        while not self.ws.closed:
+            await asyncio.sleep(interval)
+            try:
+                await self.ping()
+            except OSError:
+                return  # The receiving side will notice the missing pong
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            msg = WebSocketMessage(*await self.ws.receive())
+        except Exception:
+            self._stop_heartbeat()
+            raise
         # print(msg.data, msg.type) # DEBUG
         if (not msg.data and msg.type == self.ws.CLOSE) or self.ws.closed:
+            self._stop_heartbeat()
             raise StopAsyncIteration
         return msg
 
     async def close(self):
+        self._stop_heartbeat()
         await self.ws.close()
 
+    async def ping(self, message=b""):
+        await self.ws.send(message, self.ws.PING)
+
     async def send_str(self, data):
         if not isinstance(data, str):
             raise TypeError("data argument must be str (%r)" % type(data))
@@ -259,17 +569,129 @@ class ClientWebSocketResponse:
         data = await self.receive_str()
         return _json.loads(data)
 
+    async def receive_stream(self):
+        """Waits for the next message and returns a `WebSocketMessageStream` over its fragments.
+
+        The message type is available as `.type`; it is `CLOSE` if the connection closed.
+        """
+        stream = WebSocketMessageStream(self.ws)
+        await stream._start()
+        return stream
+
+
+class ReconnectingWebSocket:
+    """Async iterator over WebSocket messages that transparently reconnects.
+
+    Connection failures, missed heartbeats and server-side closes all lead to a
+    reconnect with exponential backoff (plus jitter); iteration simply resumes with
+    the first message of the new connection. `on_connect` is awaited with the fresh
+    `ClientWebSocketResponse` after every (re)connect, e.g. to resubscribe.
+    Iteration only stops after `close()`.
+
+    Connection problems are reported as formatted strings to `log`, e.g. a bound
+    application logger; `print` by default.
+    """
+
+    def __init__(
+        self,
+        session,
+        url,
+        ssl=None,
+        min_backoff=1,
+        max_backoff=60,
+        on_connect=None,
+        log=print,
+        **ws_kwargs,
+    ):
+        self._session = session
+        self._url = url
+        self._ssl = ssl
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._on_connect = on_connect
+        self._log = log
+        self._ws_kwargs = ws_kwargs
+        self._ws = None
+        self._closing = False
+
+    async def _connect(self):
+        delay = self._min_backoff
+        while not self._closing:
+            try:
+                ws = await self._session._ws_connect(
+                    self._url, ssl=self._ssl, **self._ws_kwargs
+                )
+                if self._on_connect:
+                    await self._on_connect(ws)
+                self._ws = ws
+                return
+            except (OSError, WebSocketError, AssertionError) as e:
+                self._log("WebSocket connect failed: {!r}, retrying in {}s".format(e, delay))
+            await asyncio.sleep(delay + random.getrandbits(8) / 256 * delay / 2)
+            delay = min(delay * 2, self._max_backoff)
+
+    async def _drop(self):
+        ws, self._ws = self._ws, None
+        ws._stop_heartbeat()
+        try:
+            await ws.ws.reader.aclose()
+        except Exception as e:
+            # The connection is given up either way, but say why it didn't close cleanly
+            self._log("WebSocket close failed: {!r}".format(e))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._closing:
+            if self._ws is None:
+                await self._connect()
+                continue
+            try:
+                return await self._ws.__anext__()
+            except StopAsyncIteration:
+                if not self._closing:
+                    self._log("WebSocket closed by the server, reconnecting")
+            except (OSError, WebSocketError, EOFError) as e:
+                self._log("WebSocket connection lost: {!r}".format(e))
+            await self._drop()
+        raise StopAsyncIteration
+
+    @property
+    def connected(self):
+        return self._ws is not None and not self._ws.ws.closed
+
+    async def send_str(self, data):
+        await self._ws.send_str(data)
+
+    async def send_bytes(self, data):
+        await self._ws.send_bytes(data)
+
+    async def send_json(self, data):
+        await self._ws.send_json(data)
+
+    async def close(self):
+        self._closing = True
+        if self._ws is not None:
+            try:
+                await self._ws.close()
+            except OSError:
+                pass
+            await self._drop()
+
 
 class _WSRequestContextManager:
     def __init__(self, client, request_co):
         self.reqco = request_co
         self.client = client
+        self.ws = None
 
     async def __aenter__(self):
-        return await self.reqco
+        self.ws = await self.reqco
+        return self.ws
 
     async def __aexit__(self, *args):
-        await self.client._reader.aclose()
+        await self.ws.ws.reader.aclose()
         return await asyncio.sleep(0)
 
 
@@ -6,9 +6,14 @@ import subprocess
 import json
 from pathlib import Path, PurePosixPath
 import hashlib
+import shutil
 
 
 OTA_HASHES_FILE = Path("_ota_hashes.json")
+BUILD_DIR = Path("build")
+
+# Executed from source by the firmware, so they can't be compiled
+SOURCE_ONLY_FILES = ("boot.py", "main.py")
 
 
 class Device:
@@ -87,6 +92,26 @@ class Device:
             raise typer.Exit(code=1)
         return True
 
+    @classmethod
+    def list_directory(cls, device_dir: PurePosixPath) -> list[str] | None:
+        result = subprocess.run(
+            ["mpremote", "ls", f":{device_dir}"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if result.returncode != 0:
+            if "No such file or directory" in result.stderr:
+                return None
+            typer.echo(
+                f"Failed to list directory '{device_dir}' on device:\n"
+                f"{result.stderr}\n"
+                "Aborting!"
+            )
+            raise typer.Exit(code=1)
+        # "ls :dir" header, then "<size> <name>" lines
+        return [line.split()[-1] for line in result.stdout.splitlines()[1:] if line]
+
     @classmethod
     def delete_directory(cls, device_dir: PurePosixPath):
         result = cls.exec_cmd(["rm", "-rv", f"{device_dir}"])
@@ -185,6 +210,51 @@ def upload(
     typer.echo(f"Local directory '{local_dir}' copied to '{device_dir}' on device!")
 
 
+def compile_directory(local_dir: Path) -> Path:
+    """Compiles the `.py` files of `local_dir` with `mpy-cross -O1` into a build directory.
+
+    Optimization strips `assert` statements and `if __debug__:` blocks, which hold the
+    debug log calls.
+    """
+    mpy_cross = shutil.which("mpy-cross")
+    if mpy_cross is None:
+        typer.echo(
+            "mpy-cross not found, install the version matching the device's firmware "
+            "(e.g. `uv tool install mpy-cross`).\nAborting!"
+        )
+        raise typer.Exit(code=1)
+
+    build_dir = BUILD_DIR / local_dir.name
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    for root, dirs, files in Path.walk(local_dir):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        target_root = build_dir / Path(root).relative_to(local_dir)
+        target_root.mkdir(parents=True, exist_ok=True)
+
+        for f in files:
+            if f == OTA_HASHES_FILE.name:
+                continue
+            if not f.endswith(".py") or f in SOURCE_ONLY_FILES:
+                shutil.copy2(root / f, target_root / f)
+                continue
+
+            target = target_root / f"{f[:-3]}.mpy"
+            result = subprocess.run(
+                [mpy_cross, "-O1", "-o", f"{target}", f"{root / f}"],
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            if result.returncode != 0:
+                typer.echo(
+                    f"Failed to compile '{root / f}':\n{result.stderr}\nAborting!"
+                )
+                raise typer.Exit(code=1)
+
+    typer.echo(f"Compiled '{local_dir}' into '{build_dir}'.")
+    return build_dir
+
+
 @dataclasses.dataclass
 class FilesMeta:
     files: dict[str, str]
@@ -209,11 +279,21 @@ def sync(
         ),
     ],
     remote_dir: Annotated[str | None, typer.Argument()] = None,
+    compile: Annotated[
+        bool,
+        typer.Option(
+            "--compile",
+            help="Upload optimized .mpy files, without debug logs and asserts.",
+        ),
+    ] = False,
 ):
     """Syncs OTA code directory on the device with local code directory."""
     remote_dir = remote_dir or local_dir.as_posix()
     device_dir = PurePosixPath(remote_dir)
 
+    if compile:
+        local_dir = compile_directory(local_dir)
+
     device_meta = FilesMeta(files={}, dirs=[])
 
     if Device.pull_file(device_dir / OTA_HASHES_FILE, local_dir / OTA_HASHES_FILE):
@@ -332,6 +412,27 @@ def delete_cache(remote_dir: str):
         typer.echo(f"No OTA cache found in folder '{device_dir}' on device.")
 
 
+@app.command()
+def logs(
+    local_dir: Annotated[Path, typer.Argument()] = Path("device_logs"),
+    remote_dir: str = "logs",
+):
+    """Downloads the log history kept on the device's flash and prints it."""
+    device_dir = PurePosixPath(remote_dir)
+    names = Device.list_directory(device_dir)
+    if not names:
+        typer.echo(f"No logs found in '{device_dir}' on device.")
+        return
+
+    local_dir.mkdir(parents=True, exist_ok=True)
+    for name in sorted(names):
+        Device.pull_file(device_dir / name, local_dir / name)
+        typer.echo((local_dir / name).read_text(errors="replace"), nl=False)
+
+    typer.echo()
+    typer.echo(f"{len(names)} log segments saved to '{local_dir}'.")
+
+
 @app.command()
 def reset():
     """Hard-resets the machine."""
@@ -0,0 +1,803 @@
+"""Local stand-in for the Ecoflow, Tuya and Telegram clouds.
+
+Implements the endpoints the board uses, verifies Ecoflow and Tuya request
+signatures, models Delta2 charging and relay/AC state, and pushes quota updates
+over a plain MQTT broker stand-in. Plugs with a `tuya_local_key` are also emulated
+on the Tuya LAN protocol. Latency, errors and timeouts can be injected
+to load-test the controller.
+
+Point the board at it by adding `simulator_url = "http://<this host>:<port>"`
+to `code/credentials.py`.
+"""
+
+import asyncio
+import binascii
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import random
+import struct
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Annotated
+from urllib.parse import parse_qsl, urlsplit
+
+import typer
+
+from host.shims.cryptolib import aes
+
+
+@dataclass
+class Faults:
+    latency_ms: int = 0
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    timeout_s: float = 120.0
+
+
+class Delta2Model:
+    """Simplified Delta2: charges while its relay is on, tapering above 80%."""
+
+    capacity_wh = 1024
+    charge_w = 1200
+    taper_start_soc = 80.0
+    ac_load_w = 60
+
+    def __init__(self, sn: str, soc: float, speed: float):
+        self.sn = sn
+        self.soc = soc
+        self.relay_on = True
+        self.ac_enabled = True
+        self.online = True
+        self._speed = speed
+        self._updated_at = time.monotonic()
+
+    def _charge_w(self, soc: float) -> float:
+        if not self.relay_on or soc >= 100:
+            return 0.0
+        if soc < self.taper_start_soc:
+            return self.charge_w
+        # Linear taper down to 10% of the charging power at 100%
+        left = (100 - soc) / (100 - self.taper_start_soc)
+        return self.charge_w * (0.1 + 0.9 * left)
+
+    def step(self):
+        now = time.monotonic()
+        hours = (now - self._updated_at) * self._speed / 3600
+        self._updated_at = now
+
+        net_w = self._charge_w(self.soc)
+        if not self.relay_on and self.ac_enabled:
+            net_w -= self.ac_load_w
+        self.soc = min(
+            100.0, max(0.0, self.soc + net_w * hours / self.capacity_wh * 100)
+        )
+
+    def remaining_minutes(self) -> int:
+        if self._charge_w(self.soc) == 0:
+            return 0
+        # Integrate over the charging curve in 1% steps
+        minutes = 0.0
+        soc = self.soc
+        while soc < 100:
+            step = min(1.0, 100 - soc)
+            minutes += step / 100 * self.capacity_wh / self._charge_w(soc) * 60
+            soc += step
+        return int(minutes)
+
+    def quotas(self) -> dict:
+        self.step()
+        charging = self._charge_w(self.soc) > 0
+        return {
+            "pd.soc": int(self.soc),
+            "pd.remainTime": self.remaining_minutes(),
+            "bms_bmsStatus.soc": int(self.soc),
+            "bms_bmsStatus.chgState": 1 if charging else 0,
+            "bms_emsStatus.chgLinePlug": 1 if self.relay_on else 0,
+            "mppt.cfgAcEnabled": 1 if self.ac_enabled else 0,
+        }
+
+
+@dataclass
+class TelegramState:
+    updates: list = field(default_factory=list)
+    next_update_id: int = 1
+    new_update: asyncio.Event = field(default_factory=asyncio.Event)
+    last_injected_at: float | None = None
+
+
+class Simulator:
+    mqtt_account = "open-simulator"
+    mqtt_password = "simulator"
+
+    def __init__(
+        self,
+        credentials,
+        faults: Faults,
+        host: str,
+        mqtt_port: int,
+        speed: float,
+        soc: float,
+    ):
+        self.creds = credentials
+        self.faults = faults
+        self.host = host
+        self.mqtt_port = mqtt_port
+
+        configs = getattr(credentials, "devices", None) or [
+            {
+                "name": "Delta2",
+                "ecoflow_sn": credentials.ecoflow_sn,
+                "tuya_device_id": credentials.tuya_device_id,
+                "tuya_local_key": getattr(credentials, "tuya_local_key", None),
+                "tuya_version": getattr(credentials, "tuya_version", "3.3"),
+            }
+        ]
+        self.devices = {
+            c["ecoflow_sn"]: Delta2Model(c["ecoflow_sn"], soc, speed) for c in configs
+        }
+        self.relays = {
+            c["tuya_device_id"]: self.devices[c["ecoflow_sn"]] for c in configs
+        }
+        self.plugs = [
+            TuyaPlug(
+                c["tuya_device_id"],
+                c["tuya_local_key"].encode(),
+                str(c.get("tuya_version", "3.3")),
+            )
+            for c in configs
+            if c.get("tuya_local_key")
+        ]
+
+        self.tuya_tokens: dict[str, float] = {}  # access token -> expires at
+        self.tuya_refresh_tokens: set[str] = set()
+        self.tuya_token_ttl_s = 7200
+
+        self.telegram = TelegramState()
+
+    # --- HTTP plumbing ---
+
+    async def handle_http(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            request_line = (await reader.readline()).decode().strip()
+            if not request_line:
+                return
+            method, target, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if self.faults.latency_ms:
+                await asyncio.sleep(self.faults.latency_ms / 1000)
+            if random.random() < self.faults.timeout_rate:
+                log(f"{method} {target} -> injected timeout")
+                await asyncio.sleep(self.faults.timeout_s)
+                return
+            if random.random() < self.faults.error_rate:
+                log(f"{method} {target} -> injected error")
+                status, result = 500, {
+                    "code": "500",
+                    "message": "Injected error",
+                    "success": False,
+                }
+            else:
+                status, result = await self.route(method, target, headers, body)
+
+            payload = json.dumps(result).encode()
+            writer.write(
+                f"HTTP/1.0 {status} OK\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+                + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            log(f"Bad request: {e}")
+        finally:
+            writer.close()
+
+    async def route(self, method: str, target: str, headers: dict, body: bytes):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        json_body = json.loads(body) if body else None
+
+        if url.path.startswith("/ecoflow/iot-open/sign/"):
+            return 200, self.ecoflow(
+                method,
+                url.path.removeprefix("/ecoflow/iot-open/sign/"),
+                query,
+                headers,
+                json_body,
+            )
+        if url.path.startswith("/tuya/"):
+            path_with_query = target.removeprefix("/tuya")
+            return 200, self.tuya(
+                method,
+                url.path.removeprefix("/tuya"),
+                path_with_query,
+                query,
+                headers,
+                body,
+                json_body,
+            )
+        if url.path.startswith("/telegram/bot"):
+            token, _, api_method = url.path.removeprefix("/telegram/bot").partition("/")
+            if token != self.creds.tg_bot_token:
+                return 401, {"ok": False, "description": "Unauthorized"}
+            return 200, await self.telegram_api(api_method, json_body or {})
+        if url.path == "/sim/telegram/send":
+            return 200, self.inject_message(json_body["text"])
+        return 404, {"error": f"Unknown endpoint {url.path}"}
+
+    # --- Ecoflow ---
+
+    @classmethod
+    def _flatten(cls, value, into: dict, key=""):
+        if isinstance(value, dict):
+            for child_key, child in value.items():
+                cls._flatten(child, into, f"{key}.{child_key}" if key else child_key)
+        elif isinstance(value, list):
+            for i, child in enumerate(value):
+                cls._flatten(child, into, f"{key}[{i}]")
+        else:
+            into[key] = value
+
+    def _ecoflow_sign_ok(self, headers: dict, query: dict, json_body) -> bool:
+        params = {}
+        self._flatten(json_body or {}, params)
+        params.update(query)
+        canonical = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        canonical += "&" if canonical else ""
+        canonical += (
+            f"accessKey={headers.get('accesskey')}"
+            f"&nonce={headers.get('nonce')}&timestamp={headers.get('timestamp')}"
+        )
+        expected = hmac.new(
+            self.creds.ecoflow_secret_key.encode(), canonical.encode(), hashlib.sha256
+        ).hexdigest()
+        return headers.get(
+            "accesskey"
+        ) == self.creds.ecoflow_access_key and hmac.compare_digest(
+            expected, headers.get("sign", "")
+        )
+
+    def ecoflow(
+        self, method: str, api_func: str, query: dict, headers: dict, json_body
+    ) -> dict:
+        if not self._ecoflow_sign_ok(headers, query, json_body):
+            log(f"Ecoflow {method} {api_func}: signature mismatch")
+            return {"code": "8521", "message": "signature is wrong"}
+
+        def ok(data=None):
+            return {"code": "0", "message": "Success", "data": data}
+
+        if method == "GET" and api_func == "device/list":
+            return ok(
+                [
+                    {"sn": d.sn, "online": int(d.online), "productName": "DELTA 2"}
+                    for d in self.devices.values()
+                ]
+            )
+
+        if method == "GET" and api_func == "certification":
+            return ok(
+                {
+                    "certificateAccount": self.mqtt_account,
+                    "certificatePassword": self.mqtt_password,
+                    "url": self.host,
+                    "port": str(self.mqtt_port),
+                    "protocol": "mqtt",
+                }
+            )
+
+        sn = query.get("sn") or (json_body or {}).get("sn")
+        device = self.devices.get(sn)
+        if device is None:
+            return {"code": "1006", "message": "device not linked"}
+        if not device.online:
+            return {"code": "1000", "message": "device offline"}
+
+        if method == "GET" and api_func == "device/quota/all":
+            return ok(device.quotas())
+
+        if method == "POST" and api_func == "device/quota":
+            quotas = device.quotas()
+            return ok(
+                {
+                    name: quotas[name]
+                    for name in json_body["params"]["quotas"]
+                    if name in quotas
+                }
+            )
+
+        if method == "PUT" and api_func == "device/quota":
+            if json_body.get("operateType") == "acOutCfg":
+                device.ac_enabled = bool(json_body["params"]["enabled"])
+                log(f"Delta2 {sn}: AC {'on' if device.ac_enabled else 'off'}")
+            return ok()
+
+        return {"code": "404", "message": f"Unknown endpoint {method} {api_func}"}
+
+    # --- Tuya ---
+
+    def _tuya_sign_ok(
+        self, method: str, path_with_query: str, headers: dict, body: bytes
+    ) -> bool:
+        token = headers.get("access_token", "")
+        string_to_sign = (
+            f"{method}\n{hashlib.sha256(body).hexdigest()}\n\n{path_with_query}"
+        )
+        str_to_sign = (
+            f"{self.creds.tuya_access_id}{token}{headers.get('t')}{string_to_sign}"
+        )
+        expected = (
+            hmac.new(
+                self.creds.tuya_access_key.encode(),
+                str_to_sign.encode(),
+                hashlib.sha256,
+            )
+            .hexdigest()
+            .upper()
+        )
+        return headers.get(
+            "client_id"
+        ) == self.creds.tuya_access_id and hmac.compare_digest(
+            expected, headers.get("sign", "")
+        )
+
+    def _issue_tuya_token(self) -> dict:
+        token = uuid.uuid4().hex
+        refresh_token = uuid.uuid4().hex
+        self.tuya_tokens[token] = time.monotonic() + self.tuya_token_ttl_s
+        self.tuya_refresh_tokens.add(refresh_token)
+        return {
+            "success": True,
+            "t": int(time.time() * 1000),
+            "result": {
+                "access_token": token,
+                "refresh_token": refresh_token,
+                "expire_time": self.tuya_token_ttl_s,
+                "uid": "simulator",
+            },
+        }
+
+    def tuya(
+        self,
+        method: str,
+        path: str,
+        path_with_query: str,
+        query: dict,
+        headers: dict,
+        body: bytes,
+        json_body,
+    ) -> dict:
+        if not self._tuya_sign_ok(method, path_with_query, headers, body):
+            log(f"Tuya {method} {path}: signature mismatch")
+            return {"success": False, "code": 1004, "msg": "sign invalid"}
+
+        if method == "GET" and path == "/v1.0/token":
+            return self._issue_tuya_token()
+        if method == "GET" and path.startswith("/v1.0/token/"):
+            refresh_token = path.removeprefix("/v1.0/token/")
+            if refresh_token not in self.tuya_refresh_tokens:
+                return {"success": False, "code": 1010, "msg": "token invalid"}
+            self.tuya_refresh_tokens.discard(refresh_token)
+            return self._issue_tuya_token()
+
+        expires_at = self.tuya_tokens.get(headers.get("access_token", ""))
+        if expires_at is None or expires_at < time.monotonic():
+            return {"success": False, "code": 1010, "msg": "token invalid"}
+
+        def ok(result):
+            return {"success": True, "t": int(time.time() * 1000), "result": result}
+
+        def status(device: Delta2Model):
+            return [{"code": "switch", "value": device.relay_on}]
+
+        if method == "GET" and path == "/v1.0/iot-03/devices/status":
+            ids = query.get("device_ids", "").split(",")
+            return ok(
+                [
+                    {"id": i, "status": status(self.relays[i])}
+                    for i in ids
+                    if i in self.relays
+                ]
+            )
+
+        parts = path.split("/")  # /v1.0/iot-03/devices/{id}/{action}
+        if len(parts) == 6 and parts[3] == "devices" and parts[4] in self.relays:
+            device = self.relays[parts[4]]
+            if method == "GET" and parts[5] == "status":
+                return ok(status(device))
+            if method == "POST" and parts[5] == "commands":
+                for command in json_body["commands"]:
+                    if command["code"] == "switch":
+                        device.step()
+                        device.relay_on = bool(command["value"])
+                        log(f"Relay {parts[4]}: {'on' if device.relay_on else 'off'}")
+                return ok(True)
+
+        return {
+            "success": False,
+            "code": 404,
+            "msg": f"Unknown endpoint {method} {path}",
+        }
+
+    # --- Telegram ---
+
+    def inject_message(self, text: str) -> dict:
+        tg = self.telegram
+        update = {
+            "update_id": tg.next_update_id,
+            "message": {
+                "message_id": tg.next_update_id,
+                "date": int(time.time()),
+                "chat": {"id": int(self.creds.tg_admin_chat_id)},
+                "text": text,
+            },
+        }
+        tg.next_update_id += 1
+        tg.updates.append(update)
+        tg.last_injected_at = time.monotonic()
+        tg.new_update.set()
+        log(f"Telegram <- {text!r}")
+        return {"ok": True, "result": update}
+
+    async def telegram_api(self, api_method: str, body: dict) -> dict:
+        tg = self.telegram
+        if api_method == "getUpdates":
+            offset = body.get("offset", 0)
+            tg.updates = [u for u in tg.updates if u["update_id"] >= offset]
+            if not tg.updates and body.get("timeout"):
+                tg.new_update.clear()
+                try:
+                    await asyncio.wait_for(tg.new_update.wait(), body["timeout"])
+                except asyncio.TimeoutError:
+                    pass
+            return {"ok": True, "result": tg.updates[: body.get("limit", 100)]}
+
+        if api_method in ("sendMessage", "editMessageText"):
+            latency = ""
+            if tg.last_injected_at is not None:
+                elapsed_ms = (time.monotonic() - tg.last_injected_at) * 1000
+                latency = f" ({elapsed_ms:.0f} ms after last command)"
+            log(
+                f"Telegram -> {api_method} to {body.get('chat_id')}{latency}:\n"
+                f"{body.get('text')}"
+            )
+            return {
+                "ok": True,
+                "result": {
+                    "message_id": body.get("message_id") or random.randint(1, 1 << 30)
+                },
+            }
+
+        return {"ok": False, "description": f"Unknown method {api_method}"}
+
+    # --- MQTT broker stand-in ---
+
+    async def handle_mqtt(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        async def read_packet():
+            header = (await reader.readexactly(1))[0]
+            length, shift = 0, 0
+            while True:
+                byte = (await reader.readexactly(1))[0]
+                length |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    break
+                shift += 7
+            return header, await reader.readexactly(length)
+
+        def send_packet(header: int, body: bytes = b""):
+            length, encoded = len(body), bytearray()
+            while True:
+                byte, length = length & 0x7F, length >> 7
+                encoded.append(byte | (0x80 if length else 0))
+                if not length:
+                    break
+            writer.write(bytes((header,)) + bytes(encoded) + body)
+
+        def read_str(data: bytes, offset: int):
+            (length,) = struct.unpack_from("!H", data, offset)
+            return data[offset + 2 : offset + 2 + length].decode(), offset + 2 + length
+
+        push_task = None
+        try:
+            header, body = await read_packet()
+            _, offset = read_str(body, 0)
+            offset += 4  # level, flags, keepalive
+            client_id, offset = read_str(body, offset)
+            user, offset = read_str(body, offset)
+            password, offset = read_str(body, offset)
+            if (user, password) != (self.mqtt_account, self.mqtt_password):
+                send_packet(0x20, b"\x00\x04")
+                return
+            send_packet(0x20, b"\x00\x00")
+            log(f"MQTT client {client_id} connected")
+
+            topics: list[str] = []
+            push_task = asyncio.create_task(
+                self._push_quotas(topics, send_packet, writer)
+            )
+            while True:
+                header, body = await read_packet()
+                if header & 0xF0 == 0x80:  # SUBSCRIBE
+                    topic, _ = read_str(body, 2)
+                    topics.append(topic)
+                    send_packet(0x90, body[:2] + b"\x00")
+                    log(f"MQTT subscribed to {topic}")
+                elif header & 0xF0 == 0xC0:  # PINGREQ
+                    send_packet(0xD0)
+                elif header & 0xF0 == 0xE0:  # DISCONNECT
+                    return
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if push_task:
+                push_task.cancel()
+            writer.close()
+
+    push_interval_s = 5
+
+    async def _push_quotas(self, topics: list, send_packet, writer):
+        type_codes = {
+            "pd": "pdStatus",
+            "mppt": "mpptStatus",
+            "bms_bmsStatus": "bmsStatus",
+            "bms_emsStatus": "emsStatus",
+        }
+        while True:
+            await asyncio.sleep(self.push_interval_s)
+            for topic in topics:
+                sn = topic.split("/")[3]
+                device = self.devices.get(sn)
+                if device is None or not device.online:
+                    continue
+                groups: dict[str, dict] = {}
+                for name, value in device.quotas().items():
+                    prefix, key = name.split(".", 1)
+                    groups.setdefault(type_codes[prefix], {})[key] = value
+                for type_code, params in groups.items():
+                    message = json.dumps(
+                        {"typeCode": type_code, "params": params}
+                    ).encode()
+                    send_packet(
+                        0x30, struct.pack("!H", len(topic)) + topic.encode() + message
+                    )
+            await writer.drain()
+
+    # --- Tuya LAN plug emulator ---
+
+    async def handle_tuya_lan(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        conn = None
+        try:
+            while True:
+                header = await reader.readexactly(16)
+                _, seq, cmd, length = struct.unpack(">4I", header)
+                body = await reader.readexactly(length)
+                if conn is None:
+                    # One port serves all plugs, tell them apart by their local keys
+                    for plug in self.plugs:
+                        conn = TuyaLanConnection(plug)
+                        if conn.accepts(header, body):
+                            break
+                    else:
+                        log("Tuya LAN: frame from an unknown device, closing")
+                        return
+                    log(f"Tuya LAN: plug {conn.plug.device_id} connected")
+
+                payload = conn.open(header, body)
+                for reply in self._tuya_lan_command(conn, cmd, payload):
+                    writer.write(conn.frame(seq, *reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            log(f"Tuya LAN: bad frame, closing: {e}")
+        finally:
+            writer.close()
+
+    def _tuya_lan_command(self, conn: "TuyaLanConnection", cmd: int, payload: bytes):
+        """Returns (cmd, payload) replies to a frame."""
+        plug = conn.plug
+        device = self.relays[plug.device_id]
+        retcode = bytes(4)
+
+        if cmd == 0x03:  # SESS_KEY_NEG_START
+            local_nonce = aes_decrypt(plug.local_key, payload)
+            conn.remote_nonce = os.urandom(16)
+            check = hmac.digest(plug.local_key, local_nonce, "sha256")
+            conn.local_nonce = local_nonce
+            reply = aes_encrypt(plug.local_key, conn.remote_nonce + check)
+            return [(0x04, retcode + reply)]
+
+        if cmd == 0x05:  # SESS_KEY_NEG_FINISH
+            check = aes_decrypt(plug.local_key, payload)
+            if check != hmac.digest(plug.local_key, conn.remote_nonce, "sha256"):
+                raise ValueError("session key negotiation failed")
+            xor = bytes(a ^ b for a, b in zip(conn.local_nonce, conn.remote_nonce))
+            conn.key = aes(plug.local_key, 1).encrypt(xor)
+            return []
+
+        if cmd == 0x09:  # HEART_BEAT
+            return [(0x09, retcode)]
+
+        if cmd in (0x07, 0x0D):  # CONTROL, CONTROL_NEW
+            data = conn.decode(payload)
+            dps = data["data"]["dps"] if cmd == 0x0D else data["dps"]
+            if plug.switch_dp in dps:
+                device.step()
+                device.relay_on = bool(dps[plug.switch_dp])
+                state = "on" if device.relay_on else "off"
+                log(f"Relay {plug.device_id}: {state} (LAN)")
+            status = {"dps": {plug.switch_dp: device.relay_on}, "t": int(time.time())}
+            return [(cmd, retcode), (0x08, conn.encode(status, version_header=True))]
+
+        if cmd in (0x0A, 0x10):  # DP_QUERY, DP_QUERY_NEW
+            status = {"devId": plug.device_id, "dps": {plug.switch_dp: device.relay_on}}
+            return [(cmd, retcode + conn.encode(status))]
+
+        log(f"Tuya LAN: unsupported command {cmd:#x}")
+        return []
+
+
+@dataclass
+class TuyaPlug:
+    device_id: str
+    local_key: bytes
+    version: str
+    switch_dp: str = "1"
+
+
+def aes_encrypt(key: bytes, data: bytes) -> bytes:
+    padding = 16 - len(data) % 16
+    return aes(key, 1).encrypt(data + bytes((padding,)) * padding)
+
+
+def aes_decrypt(key: bytes, data: bytes) -> bytes:
+    data = aes(key, 1).decrypt(data)
+    if not 1 <= data[-1] <= 16 or data[-data[-1] :] != bytes((data[-1],)) * data[-1]:
+        raise ValueError("bad padding")
+    return data[: -data[-1]]
+
+
+class TuyaLanConnection:
+    """Framing of one LAN connection of a plug, protocol 3.3 or 3.4."""
+
+    def __init__(self, plug: TuyaPlug):
+        self.plug = plug
+        self.v34 = plug.version == "3.4"
+        self.version_header = plug.version.encode() + bytes(12)
+        self.key = plug.local_key  # Session key on 3.4 once negotiated
+        self.local_nonce = self.remote_nonce = b""
+
+    def _check(self, data: bytes) -> bytes:
+        if self.v34:
+            return hmac.digest(self.key, data, "sha256")
+        return struct.pack(">I", binascii.crc32(data))
+
+    def open(self, header: bytes, body: bytes) -> bytes:
+        """Verifies a frame and returns its payload."""
+        check_len = 32 if self.v34 else 4
+        payload = body[: -check_len - 4]
+        if body[-check_len - 4 : -4] != self._check(header + payload):
+            raise ValueError("integrity check failed")
+        return payload
+
+    def accepts(self, header: bytes, body: bytes) -> bool:
+        try:
+            payload = self.open(header, body)
+            if not self.v34:
+                self.decode(payload)  # CRC doesn't depend on the key, decryption does
+            return True
+        except ValueError:
+            return False
+
+    def decode(self, payload: bytes) -> dict:
+        if not self.v34 and payload.startswith(self.version_header):
+            payload = payload[len(self.version_header) :]
+        data = aes_decrypt(self.key, payload)
+        if data.startswith(self.version_header):
+            data = data[len(self.version_header) :]
+        return json.loads(data)
+
+    def encode(self, data: dict, version_header=False) -> bytes:
+        plain = json.dumps(data).encode()
+        header = self.version_header if version_header else b""
+        if self.v34:
+            return aes_encrypt(self.key, header + plain)
+        return header + aes_encrypt(self.key, plain)
+
+    def frame(self, seq: int, cmd: int, payload: bytes) -> bytes:
+        check_len = 32 if self.v34 else 4
+        header = struct.pack(">4I", 0x55AA, seq, cmd, len(payload) + check_len + 4)
+        return header + payload + self._check(header + payload) + b"\x00\x00\xaa\x55"
+
+
+def log(text: str):
+    print(f"[{time.strftime('%H:%M:%S')}] {text}", flush=True)
+
+
+def load_credentials(path: Path):
+    spec = importlib.util.spec_from_file_location("credentials", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Credentials
+
+
+app = typer.Typer()
+
+
+@app.command()
+def serve(
+    credentials: Annotated[Path, typer.Option(exists=True, dir_okay=False)] = Path(
+        "code/credentials.py"
+    ),
+    host: Annotated[
+        str, typer.Option(help="Address advertised to the board for MQTT")
+    ] = "192.168.0.10",
+    port: int = 8080,
+    mqtt_port: int = 1883,
+    speed: Annotated[
+        float, typer.Option(help="Simulated seconds per real second")
+    ] = 1.0,
+    soc: Annotated[float, typer.Option(help="Initial state of charge, %")] = 40.0,
+    latency_ms: int = 0,
+    error_rate: Annotated[
+        float, typer.Option(help="Share of HTTP requests answered with an error")
+    ] = 0.0,
+    timeout_rate: Annotated[
+        float, typer.Option(help="Share of HTTP requests left unanswered")
+    ] = 0.0,
+    timeout_s: float = 120.0,
+    tuya_token_ttl_s: Annotated[
+        int, typer.Option(help="Lifetime of issued Tuya access tokens")
+    ] = 7200,
+    tuya_lan_port: Annotated[
+        int, typer.Option(help="Port of the Tuya LAN plug emulator, 0 to disable")
+    ] = 6668,
+):
+    """Runs the cloud simulator. Inject admin commands with:
+
+    curl -d '{"text": "Status"}' http://localhost:8080/sim/telegram/send
+    """
+    faults = Faults(latency_ms, error_rate, timeout_rate, timeout_s)
+
+    async def main():
+        sim = Simulator(
+            load_credentials(credentials), faults, host, mqtt_port, speed, soc
+        )
+        sim.tuya_token_ttl_s = tuya_token_ttl_s
+        http_server = await asyncio.start_server(sim.handle_http, "0.0.0.0", port)
+        mqtt_server = await asyncio.start_server(sim.handle_mqtt, "0.0.0.0", mqtt_port)
+        servers = [http_server, mqtt_server]
+        log(f"Simulating {len(sim.devices)} Delta2 on HTTP :{port}, MQTT :{mqtt_port}")
+        if tuya_lan_port and sim.plugs:
+            servers.append(
+                await asyncio.start_server(
+                    sim.handle_tuya_lan, "0.0.0.0", tuya_lan_port
+                )
+            )
+            log(f"Emulating {len(sim.plugs)} Tuya plugs on LAN :{tuya_lan_port}")
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    app()